@@ -5,15 +5,24 @@ __email__ = "niklas.fiekas@backscattering.de"
 __version__ = "1.3.0"
 __license__ = "PSFL"
 
+import abc
+import bisect
 import collections
 import collections.abc
+import functools
+import itertools
 import operator
 import reprlib
+import time
+import weakref
 
 
 class IndexedOrderedDict(dict):
     """A dictionary that is indexed by insertion order."""
 
+    #: Views that are notified of changes, see ``sorted_values_view()``.
+    _observers = ()
+
     def __init__(self, *args, **kwds):
         """
         Initialize an ordered dictionary.  The signature is the same as
@@ -23,31 +32,54 @@ class IndexedOrderedDict(dict):
             raise TypeError('expected at most 1 arguments, got %d' % len(args))
 
         self._map = []
+        self._order_token = None
+        self._version = 0
+        self._view_cache = {}
         self.__update(*args, **kwds)
 
     def __setitem__(self, key, value, *, __dict_setitem=dict.__setitem__):
         """iod.__setitem__(i, y) <==> iod[i] = y"""
         if key not in self:
             self._map.append(key)
+            self._order_token = None
+        self._version += 1
         __dict_setitem(self, key, value)
+        if self._observers:
+            _notify_set(self, key, value)
 
     def __delitem__(self, key, *, __dict_delitem=dict.__delitem__):
         """iod.__delitem__(y) <==> del iod[y]"""
         __dict_delitem(self, key)
-        self._map.remove(key)
+        self._order_token = None
+        self._version += 1
+        if self._observers:
+            _notify_discard(self, key)
+        keys = self._map
+        # A lazy engine already reflects the deletion from the dict, so it
+        # may be empty here.
+        if keys and keys[-1] == key:
+            # list.remove() scans from the front, so the most recently
+            # inserted key would be the worst case.
+            keys.pop()
+        else:
+            keys.remove(key)
 
     def __iter__(self):
         """iod.__iter__() <==> iter(iod)"""
-        return self._map.__iter__()
+        return _guarded(self, self._map.__iter__())
 
     def __reversed__(self):
         """iod.__reversed__() <==> reversed(iod)"""
-        return self._map.__reversed__()
+        return _guarded(self, self._map.__reversed__())
 
     def clear(self):
         """iod.clear() -> None.  Remove all items from iod."""
         self._map.clear()
+        self._order_token = None
+        self._version += 1
         dict.clear(self)
+        if self._observers:
+            _notify_clear(self)
 
     def popitem(self, last=True):
         """
@@ -56,6 +88,10 @@ class IndexedOrderedDict(dict):
         """
         key = self._map.pop() if last else self._map.pop(0)
         value = dict.pop(self, key)
+        self._order_token = None
+        self._version += 1
+        if self._observers:
+            _notify_discard(self, key)
         return key, value
 
     def move_to_end(self, key, last=True):
@@ -66,12 +102,54 @@ class IndexedOrderedDict(dict):
         When last=True, acts like a faster version of self[key]=self.pop(key).
         """
         self._map.remove(key)
+        self._order_token = None
+        self._version += 1
         if last:
             self._map.append(key)
         else:
             self._map.insert(0, key)
 
-    update = __update = collections.abc.MutableMapping.update
+    def update(self, *args, **kwds):
+        """
+        iod.update([E, ]**F) -> None.  Update iod from dict/iterable E and F.
+        New keys are appended in the order they appear.
+        """
+        if len(args) > 1:
+            raise TypeError('update expected at most 1 argument, got %d' % len(args))
+        if type(self).__setitem__ is not IndexedOrderedDict.__setitem__:
+            # Respect subclasses that customize item assignment.
+            collections.abc.MutableMapping.update(self, *args, **kwds)
+            return
+        if args:
+            other = args[0]
+            if not isinstance(other, dict):
+                other = dict(other)
+            self.__merge(other)
+        if kwds:
+            self.__merge(kwds)
+
+    __update = update
+
+    def __merge(self, other):
+        keys = items = other
+        if isinstance(other, IndexedOrderedDict):
+            # dict.update() would go through keys() and __getitem__ one key
+            # at a time, since the subclass overrides __iter__.
+            keys = list(other)
+            items = zip(keys, map(_lookup(other), keys))
+        if self:
+            new_keys = list(itertools.filterfalse(self.__contains__, keys))
+        else:
+            new_keys = list(keys)
+        dict.update(self, items)
+        self._version += 1
+        if new_keys:
+            self._map.extend(new_keys)
+            self._order_token = None
+        if self._observers:
+            for key, value in other.items():
+                _notify_set(self, key, value)
+
     __ne__ = collections.abc.MutableMapping.__ne__
 
     def keys(self):
@@ -92,7 +170,7 @@ class IndexedOrderedDict(dict):
         is raised.
         """
         if key in self:
-            result = self[key]
+            result = dict.__getitem__(self, key)
             del self[key]
             return result
         if default is self.__marker:
@@ -111,6 +189,86 @@ class IndexedOrderedDict(dict):
     def sort(self, *, key=None, reverse=False):
         """Sort the dictionary by key in place."""
         self._map.sort(key=key, reverse=reverse)
+        self._order_token = None
+        self._version += 1
+
+    def map_values(self, fn, executor=None, chunksize=1):
+        """
+        Return a new dictionary with the same keys in the same order and
+        ``fn(value)`` as values.  If an executor from ``concurrent.futures``
+        is given, the values are sent to it in index-ordered chunks of
+        *chunksize*.
+        """
+        keys, results = _map_values(self, fn, executor, chunksize)
+        new = self.__class__()
+        if new.engine is not self.engine:
+            new.set_engine(self.engine)
+        _fill(new, keys, results)
+        return new
+
+    def partition(self, n):
+        """
+        Split the items into *n* consecutive windows of nearly equal size,
+        e.g., to hand them to a thread or process pool.  Each window has
+        ``start`` and ``stop`` positions, and ``IndexedOrderedDict(window)``
+        turns it into a sub-dictionary.  Pickled windows only carry their
+        own items.
+        """
+        if n < 1:
+            raise ValueError("number of partitions must be positive")
+        items = self.items()
+        size, rest = divmod(len(self), n)
+        windows = []
+        start = 0
+        for i in range(n):
+            stop = start + size + (i < rest)
+            windows.append(items[start:stop])
+            start = stop
+        return windows
+
+    def sorted_values_view(self, key=None):
+        """
+        Return a view of the items sorted by value, or by ``key(value)``,
+        with ties in the order the values were set.  The view is updated
+        in logarithmic time whenever an item changes, so ``view[i]``,
+        ``view[-k:]`` and ``view.rank(key)`` do not sort the items again.
+        """
+        view = SortedValuesView(self, key)
+        if not self._observers:
+            self._observers = weakref.WeakSet()
+        self._observers.add(view)
+        return view
+
+    def set_engine(self, engine):
+        """
+        Replace the structure that keeps track of the key order.  *engine*
+        is a name from ``indexed.ENGINES``, e.g., ``d.set_engine("tree")``,
+        or an :class:`OrderEngine` class, which is called with the keys in
+        their current order.
+        """
+        self.__attach(_engine_class(engine)(self._map))
+
+    def __attach(self, engine):
+        attach = getattr(engine, "_attach", None)
+        if attach is not None:
+            attach(self)
+        self._map = engine
+
+    @property
+    def engine(self):
+        """The class of the structure that keeps track of the key order."""
+        return type(self._map)
+
+    @classmethod
+    def with_engine(cls, engine, *args, **kwds):
+        """
+        IOD.with_engine(engine[, E], **F) -> New indexed ordered dictionary
+        that uses the given engine, initialized like IOD(E, **F).
+        """
+        self = cls()
+        self.set_engine(engine)
+        self.update(*args, **kwds)
+        return self
 
     @reprlib.recursive_repr()
     def __repr__(self):
@@ -122,13 +280,30 @@ class IndexedOrderedDict(dict):
     def __reduce__(self):
         """Return state information for pickling"""
         inst_dict = vars(self).copy()
-        for k in vars(IndexedOrderedDict()):
+        for k in self._internal_attributes:
             inst_dict.pop(k, None)
-        return self.__class__, (), inst_dict or None, None, iter(self.items())
+        keys = list(self._map)
+        values = list(map(functools.partial(dict.__getitem__, self), keys))
+        return _restore, (self.__class__, type(self._map), keys, values), inst_dict or None
 
     def copy(self):
         """od.copy() -> a shallow copy of iod"""
-        return self.__class__(self)
+        new = self.__class__()
+        dict.update(new, dict.items(self))
+        new.__attach(self._map.copy())
+        new._order_token = self._share_order_token()
+        return new
+
+    def _share_order_token(self):
+        """
+        Return a token that is shared by dictionaries with the same order
+        and replaced whenever the order changes.
+        """
+        if self._order_token is None:
+            self._order_token = object()
+        return self._order_token
+
+    __copy__ = copy
 
     @classmethod
     def fromkeys(cls, iterable, value=None):
@@ -137,8 +312,7 @@ class IndexedOrderedDict(dict):
         If not specified, the value defaults to None.
         """
         self = cls()
-        for key in iterable:
-            self[key] = value
+        self.update(dict.fromkeys(iterable, value))
         return self
 
     def __eq__(self, other):
@@ -147,21 +321,41 @@ class IndexedOrderedDict(dict):
         order-sensitive while comparison to a regular mapping is
         order-insensitive.
         """
-        if isinstance(other, collections.OrderedDict) or isinstance(other, IndexedOrderedDict):
+        if isinstance(other, IndexedOrderedDict):
+            if dict.__len__(self) != dict.__len__(other) or not dict.__eq__(self, other):
+                return False
+            if self._order_token is not None and self._order_token is other._order_token:
+                return True
+            if isinstance(self._map, list) and isinstance(other._map, list):
+                equal = list.__eq__(self._map, other._map)
+            else:
+                equal = all(map(operator.eq, self._map, other._map))
+            if equal:
+                # Remember the result until either order changes.  Tokens
+                # are never replaced while the order stays the same, since
+                # running iterators check them.
+                if other._order_token is None:
+                    other._order_token = self._share_order_token()
+                elif self._order_token is None:
+                    self._order_token = other._order_token
+            return equal
+        if isinstance(other, collections.OrderedDict):
             return dict.__eq__(self, other) and all(map(operator.eq, self, other))
         return dict.__eq__(self, other)
 
     def __or__(self, other):
         if not isinstance(other, dict):
             return NotImplemented
-        new = self.__class__(self)
+        new = self.copy()
         new.update(other)
         return new
 
     def __ror__(self, other):
         if not isinstance(other, dict):
             return NotImplemented
-        new = self.__class__(other)
+        new = self.copy()
+        new.clear()
+        new.update(other)
         new.update(self)
         return new
 
@@ -172,22 +366,2358 @@ class IndexedOrderedDict(dict):
 
 Dict = IndexedOrderedDict
 
+IndexedOrderedDict._internal_attributes = frozenset(vars(IndexedOrderedDict())) | {"_observers"}
+
+
+def _map_values(mapping, fn, executor, chunksize):
+    """Return the keys in order and the results of *fn* for their values."""
+    keys = list(mapping._map)
+    values = map(_lookup(mapping), keys)
+    if executor is None:
+        return keys, list(map(fn, values))
+    return keys, list(executor.map(fn, values, chunksize=chunksize))
+
+
+def _restore(cls, engine, keys, values):
+    """Rebuild a pickled dictionary from its keys and values in order."""
+    self = cls()
+    if self.engine is not engine:
+        self.set_engine(engine)
+    _fill(self, keys, values)
+    return self
+
+
+def _fill(self, keys, values):
+    """Fill an empty dictionary with distinct keys and their values."""
+    if type(self).__setitem__ is IndexedOrderedDict.__setitem__:
+        dict.update(self, zip(keys, values))
+        self._map.extend(keys)
+    else:
+        for key, value in zip(keys, values):
+            self[key] = value
+
 
-class IndexedKeysView(collections.abc.KeysView):
+class _NativeSetOperations:
+    """
+    Set operations on key and item views, delegated to the native view of
+    the underlying dict.  The results are sets, as for dict views.
+    """
+
+    __slots__ = ()
+
+    def __and__(self, other):
+        return self._native() & other
+
+    def __or__(self, other):
+        return self._native() | other
+
+    def __xor__(self, other):
+        return self._native() ^ other
+
+    def __sub__(self, other):
+        return self._native() - other
+
+    def __rsub__(self, other):
+        return self._native().__rsub__(other)
+
+    __rand__ = __and__
+    __ror__ = __or__
+    __rxor__ = __xor__
+
+    def isdisjoint(self, other):
+        return self._native().isdisjoint(other)
+
+
+class IndexedKeysView(_NativeSetOperations, collections.abc.KeysView):
     def __getitem__(self, index):
+        if isinstance(index, slice):
+            return IndexedSliceView(self, range(len(self))[index])
         return self._mapping._map[index]
 
+    def __iter__(self):
+        return _guarded(self._mapping, iter(self._mapping._map))
+
+    def __reversed__(self):
+        return _guarded(self._mapping, reversed(self._mapping._map))
+
+    def tolist(self):
+        """Return the keys as a list."""
+        return list(self._mapping._map)
+
+    def __contains__(self, key):
+        return dict.__contains__(self._mapping, key)
+
+    def _native(self):
+        return dict.keys(self._mapping)
+
+    def _iter_positions(self, positions):
+        return map(self._mapping._map.__getitem__, positions)
+
     def index(self, x):
         return self._mapping._map.index(x)
 
+    def chunks(self, size):
+        """
+        Yield consecutive windows of at most *size* keys, e.g., to hand
+        them to a thread or process pool.  Each window has ``start`` and
+        ``stop`` positions.
+        """
+        return _chunks(self, size)
+
+    def take(self, indices):
+        """
+        Return the keys at the given positions, or where the boolean mask
+        *indices* is true, as a list.
+        """
+        return list(self._iter_positions(_positions(self, indices)))
+
+    def ordered_intersection(self, other):
+        """Return the keys that are also in *other*, in insertion order."""
+        other = _as_container(other)
+        return list(filter(other.__contains__, self._mapping._map))
+
+    def ordered_difference(self, other):
+        """Return the keys that are not in *other*, in insertion order."""
+        other = _as_container(other)
+        return list(itertools.filterfalse(other.__contains__, self._mapping._map))
+
+    def ordered_union(self, other):
+        """
+        Return the keys in insertion order, followed by the new keys from
+        *other* in their order.
+        """
+        new = itertools.filterfalse(self.__contains__, dict.fromkeys(other))
+        return list(itertools.chain(self._mapping._map, new))
+
+    def ordered_symmetric_difference(self, other):
+        """
+        Return the keys that are not in *other* in insertion order,
+        followed by the keys from *other* that are not keys, in their order.
+        """
+        other = dict.fromkeys(other)
+        new = itertools.filterfalse(self.__contains__, other)
+        return self.ordered_difference(other) + list(new)
+
+    def indices_of(self, keys):
+        """Return the positions of the given keys as a list."""
+        engine = self._mapping._map
+        keys = list(keys)
+        if getattr(engine, "linear_index", True) and len(keys) > 1:
+            # A single pass beats one linear scan per key.
+            table = dict(zip(engine, itertools.count()))
+            try:
+                return list(map(table.__getitem__, keys))
+            except KeyError as err:
+                raise ValueError("%r is not in list" % (err.args[0], )) from None
+        return list(map(engine.index, keys))
+
 
 class IndexedValuesView(collections.abc.ValuesView):
     def __getitem__(self, index):
+        if isinstance(index, slice):
+            return IndexedSliceView(self, range(len(self))[index])
         key = self._mapping._map[index]
-        return self._mapping[key]
+        return dict.__getitem__(self._mapping, key)
+
+    def __iter__(self):
+        return _guarded(self._mapping, iter(self._materialize()))
+
+    def __reversed__(self):
+        return _guarded(self._mapping, reversed(self._materialize()))
+
+    def tolist(self):
+        """
+        Return the values as a new list.  The values are cached until the
+        dictionary is modified, and iterating over the view reuses them.
+        """
+        return list(self._materialize())
+
+    def _materialize(self):
+        cached = _cached(self._mapping, "values")
+        if cached is None:
+            cached = _cache(self._mapping, "values", list(map(_lookup(self._mapping), self._mapping._map)))
+        return cached
+
+    def __contains__(self, value):
+        return value in dict.values(self._mapping)
+
+    def _iter_positions(self, positions):
+        keys = map(self._mapping._map.__getitem__, positions)
+        return map(_lookup(self._mapping), keys)
+
+    def chunks(self, size):
+        """
+        Yield consecutive windows of at most *size* values, e.g., to hand
+        them to a thread or process pool.  Each window has ``start`` and
+        ``stop`` positions.
+        """
+        return _chunks(self, size)
+
+    def take(self, indices):
+        """
+        Return the values at the given positions, or where the boolean mask
+        *indices* is true, as a list.
+        """
+        return list(self._iter_positions(_positions(self, indices)))
 
 
-class IndexedItemsView(collections.abc.ItemsView):
+class IndexedItemsView(_NativeSetOperations, collections.abc.ItemsView):
     def __getitem__(self, index):
+        if isinstance(index, slice):
+            return IndexedSliceView(self, range(len(self))[index])
         key = self._mapping._map[index]
-        return key, self._mapping[key]
+        return key, dict.__getitem__(self._mapping, key)
+
+    def __iter__(self):
+        return _guarded(self._mapping, iter(self._materialize()))
+
+    def __reversed__(self):
+        return _guarded(self._mapping, reversed(self._materialize()))
+
+    def tolist(self):
+        """
+        Return the items as a new list.  The items are cached until the
+        dictionary is modified, and iterating over the view reuses them.
+        """
+        return list(self._materialize())
+
+    def _materialize(self):
+        cached = _cached(self._mapping, "items")
+        if cached is None:
+            keys = self._mapping._map
+            cached = _cache(self._mapping, "items", list(zip(iter(keys), map(_lookup(self._mapping), keys))))
+        return cached
+
+    def __contains__(self, item):
+        return item in dict.items(self._mapping)
+
+    def _native(self):
+        return dict.items(self._mapping)
+
+    def _iter_positions(self, positions):
+        keys, lookup = itertools.tee(map(self._mapping._map.__getitem__, positions))
+        return zip(keys, map(_lookup(self._mapping), lookup))
+
+    def chunks(self, size):
+        """
+        Yield consecutive windows of at most *size* items, e.g., to hand
+        them to a thread or process pool.  Each window has ``start`` and
+        ``stop`` positions.
+        """
+        return _chunks(self, size)
+
+    def take(self, indices):
+        """
+        Return the items at the given positions, or where the boolean mask
+        *indices* is true, as a list.
+        """
+        return list(self._iter_positions(_positions(self, indices)))
+
+
+def _as_container(iterable):
+    if isinstance(iterable, (collections.abc.Set, dict)):
+        return iterable
+    return set(iterable)
+
+
+def _guarded(mapping, iterator):
+    """
+    Wrap *iterator* so that it raises RuntimeError when *mapping* changes,
+    like iterators over dicts do.  Adding or removing keys is detected at
+    the next step, by walking a native dict iterator alongside, and any
+    other change of the order when the iterator is exhausted.  Assigning
+    values to existing keys is allowed.
+    """
+    token = mapping._share_order_token()
+    # Items of a dict are non-empty tuples, so compress() passes everything
+    # on until the native iterator stops or raises.
+    iterator = itertools.compress(iterator, dict.items(mapping))
+    return itertools.chain(iterator, _check_order(mapping, token))
+
+
+def _check_order(mapping, token):
+    if mapping._order_token is not token:
+        raise RuntimeError("%s mutated during iteration" % (mapping.__class__.__name__, ))
+    yield from ()
+
+
+def _notify_set(mapping, key, value):
+    for view in mapping._observers:
+        view._set(key, value)
+
+
+def _notify_discard(mapping, key):
+    for view in mapping._observers:
+        view._discard(key)
+
+
+def _notify_clear(mapping):
+    for view in mapping._observers:
+        view._reset()
+
+
+def _check_version(mapping, version):
+    if mapping._version != version:
+        raise RuntimeError("%s changed during iteration" % (mapping.__class__.__name__, ))
+    yield from ()
+
+
+def _cached(mapping, kind):
+    """Return the cached list of *kind*, unless the mapping was modified."""
+    entry = mapping._view_cache.get(kind)
+    if entry is not None and entry[0] == mapping._version:
+        return entry[1]
+    return None
+
+
+def _cache(mapping, kind, materialized):
+    mapping._view_cache[kind] = mapping._version, materialized
+    return materialized
+
+
+def _lookup(mapping):
+    """
+    Look up values without going through ``__getitem__`` overrides, which
+    may have side effects such as promoting a key.
+    """
+    return functools.partial(dict.__getitem__, mapping)
+
+
+def _chunks(view, size):
+    if size < 1:
+        raise ValueError("chunk size must be positive")
+    stop = len(view)
+    for start in range(0, stop, size):
+        yield view[start:min(start + size, stop)]
+
+
+def _positions(view, indices):
+    """
+    Turn a sequence of positions, a NumPy integer array or a boolean mask
+    into an iterable of positions.
+    """
+    dtype = getattr(indices, "dtype", None)
+    if dtype is not None:
+        if dtype.kind == "b":
+            return _mask_positions(view, indices.tolist())
+        return indices.tolist()
+    indices = list(indices)
+    if indices and all(type(index) is bool for index in indices):
+        return _mask_positions(view, indices)
+    return indices
+
+
+def _mask_positions(view, mask):
+    if len(mask) != len(view):
+        raise IndexError("boolean mask of length %d does not match view of length %d" % (len(mask), len(view)))
+    return itertools.compress(itertools.count(), mask)
+
+
+class IndexedSliceView(collections.abc.Sequence):
+    """
+    A window into a key, value or item view, e.g., ``d.values()[10:20]``.
+    Nothing is copied: the window remembers the selected positions and
+    looks up whatever is currently stored at them.
+    """
+
+    __slots__ = ("_view", "_range")
+
+    def __init__(self, view, positions):
+        self._view = view
+        self._range = positions
+
+    @property
+    def start(self):
+        return self._range.start
+
+    @property
+    def stop(self):
+        return self._range.stop
+
+    @property
+    def step(self):
+        return self._range.step
+
+    def __len__(self):
+        return len(self._range)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return IndexedSliceView(self._view, self._range[index])
+        return self._view[self._range[index]]
+
+    def __iter__(self):
+        return self._view._iter_positions(self._range)
+
+    def __reversed__(self):
+        return self._view._iter_positions(reversed(self._range))
+
+    def __eq__(self, other):
+        # Slicing a view used to return a list, so compare like one.
+        if isinstance(other, (IndexedSliceView, list, tuple)):
+            return len(self) == len(other) and list(self) == list(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __reduce__(self):
+        # Ship only the selected entries, e.g., to a process pool, rather
+        # than the whole dictionary.  The copy keeps its positions.
+        return IndexedSliceView, (_DetachedView(zip(self._range, self)), self._range)
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, list(self))
+
+
+class _DetachedView(dict):
+    """The entries of an unpickled window, by position."""
+
+    __slots__ = ()
+
+    def _iter_positions(self, positions):
+        return map(self.__getitem__, positions)
+
+
+class OrderEngine(abc.ABC):
+    """
+    Base class for the structures that keep track of the key order of an
+    :class:`IndexedOrderedDict`.
+
+    Engines are constructed from an iterable of keys and support ``len()``,
+    iteration, ``reversed()``, ``in``, access by position and slice, and the
+    ``append()``, ``extend()``, ``insert()``, ``remove()``, ``pop()``,
+    ``index()``, ``clear()``, ``copy()`` and ``sort()`` methods of ``list``
+    with the same semantics.  ``list`` itself is the default engine.
+    """
+
+    #: Whether ``index()`` has to scan the keys.
+    linear_index = False
+
+    @abc.abstractmethod
+    def __len__(self):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def __iter__(self):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def __reversed__(self):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def __getitem__(self, index):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def index(self, key):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def append(self, key):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def insert(self, index, key):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def remove(self, key):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def pop(self, index=-1):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def clear(self):
+        raise NotImplementedError
+
+    def _normalize(self, index):
+        size = len(self)
+        if index < 0:
+            index += size
+        if not 0 <= index < size:
+            raise IndexError("list index out of range")
+        return index
+
+    def __contains__(self, key):
+        try:
+            self.index(key)
+        except ValueError:
+            return False
+        return True
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, list(self))
+
+    def extend(self, iterable):
+        for key in iterable:
+            self.append(key)
+
+    def copy(self):
+        return self.__class__(self)
+
+    def sort(self, *, key=None, reverse=False):
+        keys = sorted(self, key=key, reverse=reverse)
+        self.clear()
+        self.extend(keys)
+
+
+OrderEngine.register(list)
+
+
+class _FenwickTree(list):
+    """
+    Binary indexed tree over a sequence of counts, stored 1-based with a
+    dummy element at position 0.
+    """
+
+    def __init__(self, counts=()):
+        super().__init__([0])
+        self.extend(counts)
+        size = len(self) - 1
+        for i in range(1, size + 1):
+            j = i + (i & -i)
+            if j <= size:
+                self[j] += self[i]
+
+    def add(self, i, delta):
+        size = len(self)
+        i += 1
+        while i < size:
+            self[i] += delta
+            i += i & -i
+
+    def prefix(self, i):
+        """Sum of the first *i* counts."""
+        total = 0
+        while i:
+            total += self[i]
+            i -= i & -i
+        return total
+
+    def push(self, count):
+        """Append a count at the end."""
+        i = len(self)
+        low = i - (i & -i)
+        self.append(count + self.prefix(i - 1) - self.prefix(low))
+
+    def find(self, k):
+        """
+        Find the position *i* such that *k* falls into the *i*-th count, and
+        the offset of *k* within it.
+        """
+        size = len(self) - 1
+        pos = 0
+        mask = 1 << (size.bit_length() - 1) if size else 0
+        while mask:
+            nxt = pos + mask
+            if nxt <= size and self[nxt] <= k:
+                pos = nxt
+                k -= self[nxt]
+            mask >>= 1
+        return pos, k
+
+
+class BlockedList(OrderEngine):
+    """
+    An ordering engine for :class:`IndexedOrderedDict` that keeps the keys in
+    a list of short blocks.  Block sizes are tracked in a Fenwick tree, so
+    positional access, positional insertion, deletion and index lookup are
+    logarithmic in the number of blocks plus linear in the block size.
+
+    Select it with ``d.set_engine("tree")``.
+    """
+
+    _load = 512
+
+    def __init__(self, iterable=()):
+        self._blocks = []
+        self._owner = {}
+        self._rebuild()
+        self.extend(iterable)
+
+    def _rebuild(self):
+        blocks = self._blocks = [block for block in self._blocks if block]
+        self._tree = _FenwickTree(map(len, blocks))
+        self._positions = {id(block): i for i, block in enumerate(blocks)}
+        self._len = sum(map(len, blocks))
+
+    def _add(self, b, delta):
+        self._tree.add(b, delta)
+        self._len += delta
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        return itertools.chain.from_iterable(self._blocks)
+
+    def __reversed__(self):
+        return itertools.chain.from_iterable(map(reversed, reversed(self._blocks)))
+
+    def __contains__(self, key):
+        return key in self._owner
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self)[index]
+        b, offset = self._tree.find(self._normalize(index))
+        return self._blocks[b][offset]
+
+    def index(self, key):
+        try:
+            block = self._owner[key]
+        except KeyError:
+            raise ValueError("%r is not in list" % (key, )) from None
+        return self._tree.prefix(self._positions[id(block)]) + block.index(key)
+
+    def append(self, key):
+        blocks = self._blocks
+        if blocks and len(blocks[-1]) < self._load:
+            block = blocks[-1]
+            block.append(key)
+            self._owner[key] = block
+            self._add(len(blocks) - 1, 1)
+        else:
+            block = [key]
+            blocks.append(block)
+            self._owner[key] = block
+            self._positions[id(block)] = len(blocks) - 1
+            self._tree.push(1)
+            self._len += 1
+
+    def extend(self, iterable):
+        blocks = self._blocks
+        keys = list(iterable)
+        if not keys:
+            return
+        if blocks:
+            keys = blocks.pop() + keys
+        load = self._load
+        for start in range(0, len(keys), load):
+            block = keys[start:start + load]
+            blocks.append(block)
+            self._owner.update(dict.fromkeys(block, block))
+        self._rebuild()
+
+    def insert(self, index, key):
+        if index < 0:
+            index = max(index + self._len, 0)
+        if index >= self._len:
+            self.append(key)
+            return
+        b, offset = self._tree.find(index)
+        block = self._blocks[b]
+        block.insert(offset, key)
+        self._owner[key] = block
+        if len(block) > 2 * self._load:
+            half = block[self._load:]
+            del block[self._load:]
+            self._blocks.insert(b + 1, half)
+            self._owner.update(dict.fromkeys(half, half))
+            self._rebuild()
+        else:
+            self._add(b, 1)
+
+    def _discard(self, b, block):
+        if block:
+            self._add(b, -1)
+        else:
+            self._rebuild()
+
+    def remove(self, key):
+        try:
+            block = self._owner.pop(key)
+        except KeyError:
+            raise ValueError("%r is not in list" % (key, )) from None
+        block.remove(key)
+        self._discard(self._positions[id(block)], block)
+
+    def pop(self, index=-1):
+        b, offset = self._tree.find(self._normalize(index))
+        block = self._blocks[b]
+        key = block.pop(offset)
+        del self._owner[key]
+        self._discard(b, block)
+        return key
+
+    def clear(self):
+        self._blocks.clear()
+        self._owner.clear()
+        self._rebuild()
+
+
+_TOMBSTONE = object()
+
+_is_live = functools.partial(operator.is_not, _TOMBSTONE)
+
+
+class TombstoneList(OrderEngine):
+    """
+    An ordering engine for :class:`IndexedOrderedDict` that deletes keys by
+    marking their slot as dead.  A Fenwick tree counts the live slots, so
+    deletion, positional access and index lookup are logarithmic.  Dead
+    slots are compacted away once they make up more than
+    ``compact_ratio`` of all slots.  Free slots in front of the first key
+    make inserting at the front cheap as well, so ``d.move_to_end(key)``
+    is logarithmic in both directions.
+
+    Select it with ``d.set_engine("tombstone")``.
+    """
+
+    compact_ratio = 0.5
+
+    def __init__(self, iterable=()):
+        self._slots = []
+        self._slot_of = {}
+        self._live = _FenwickTree()
+        self._head = 0
+        self.extend(iterable)
+
+    def _compact(self, keys=None, gap=0):
+        keys = list(self) if keys is None else keys
+        self._slots = [_TOMBSTONE] * gap + keys
+        self._slot_of = dict(zip(keys, itertools.count(gap)))
+        self._live = _FenwickTree(itertools.chain(itertools.repeat(0, gap), itertools.repeat(1, len(keys))))
+        self._head = gap
+
+    def __len__(self):
+        return len(self._slot_of)
+
+    def __iter__(self):
+        return filter(_is_live, self._slots)
+
+    def __reversed__(self):
+        return filter(_is_live, reversed(self._slots))
+
+    def __contains__(self, key):
+        return key in self._slot_of
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self)[index]
+        return self._slots[self._live.find(self._normalize(index))[0]]
+
+    def index(self, key):
+        try:
+            slot = self._slot_of[key]
+        except KeyError:
+            raise ValueError("%r is not in list" % (key, )) from None
+        return self._live.prefix(slot)
+
+    def append(self, key):
+        self._slot_of[key] = len(self._slots)
+        self._slots.append(key)
+        self._live.push(1)
+
+    def extend(self, iterable):
+        keys = list(iterable)
+        if len(keys) > len(self._slots):
+            self._compact(list(self) + keys)
+        else:
+            for key in keys:
+                self.append(key)
+
+    def insert(self, index, key):
+        if index < 0:
+            index = max(index + len(self), 0)
+        if index >= len(self):
+            self.append(key)
+        elif index == 0:
+            if not self._head:
+                self._compact(gap=max(len(self), 8))
+            self._head -= 1
+            self._slots[self._head] = key
+            self._slot_of[key] = self._head
+            self._live.add(self._head, 1)
+        else:
+            keys = list(self)
+            keys.insert(index, key)
+            self._compact(keys)
+
+    def _kill(self, slot):
+        slots = self._slots
+        slots[slot] = _TOMBSTONE
+        live = self._live
+        if not self._slot_of:
+            self.clear()
+        elif slot == len(slots) - 1:
+            # Dead slots at the end can be dropped right away.
+            while slots[-1] is _TOMBSTONE:
+                slots.pop()
+                live.pop()
+        else:
+            live.add(slot, -1)
+            if slot == self._head:
+                # Dead slots at the front become free slots.
+                while slots[self._head] is _TOMBSTONE:
+                    self._head += 1
+            size = len(slots) - self._head
+            if self._head > size or size - len(self._slot_of) > self.compact_ratio * size:
+                self._compact()
+
+    def remove(self, key):
+        try:
+            slot = self._slot_of.pop(key)
+        except KeyError:
+            raise ValueError("%r is not in list" % (key, )) from None
+        self._kill(slot)
+
+    def pop(self, index=-1):
+        slot = self._live.find(self._normalize(index))[0]
+        key = self._slots[slot]
+        del self._slot_of[key]
+        self._kill(slot)
+        return key
+
+    def clear(self):
+        self._slots.clear()
+        self._slot_of.clear()
+        self._live = _FenwickTree()
+        self._head = 0
+
+    def sort(self, *, key=None, reverse=False):
+        keys = list(self)
+        keys.sort(key=key, reverse=reverse)
+        self._compact(keys)
+
+
+class PositionList(list, OrderEngine):
+    """
+    An ordering engine for :class:`IndexedOrderedDict` that is a plain list
+    of keys plus a mapping from each key to its position.  Index lookup is a
+    single hash probe.  Positions are stored relative to a base, so that
+    inserting or deleting a key only renumbers the keys before or after it,
+    whichever are fewer, and changes at either end are cheap.
+
+    Select it with ``d.set_engine("position")``.
+    """
+
+    def __init__(self, iterable=()):
+        super().__init__(iterable)
+        self._base = 0
+        self._renumber(0)
+
+    def _renumber(self, start, stop=None):
+        if start == 0 and stop is None:
+            self._slot_of = dict(zip(self, itertools.count(self._base)))
+        else:
+            self._slot_of.update(zip(self[start:stop], itertools.count(start + self._base)))
+
+    def __contains__(self, key):
+        return key in self._slot_of
+
+    def __repr__(self):
+        return "%s(%s)" % (self.__class__.__name__, list.__repr__(self))
+
+    def index(self, key):
+        try:
+            return self._slot_of[key] - self._base
+        except KeyError:
+            raise ValueError("%r is not in list" % (key, )) from None
+
+    def append(self, key):
+        self._slot_of[key] = len(self) + self._base
+        list.append(self, key)
+
+    def extend(self, iterable):
+        start = len(self)
+        list.extend(self, iterable)
+        self._renumber(start)
+
+    def insert(self, index, key):
+        if index < 0:
+            index = max(index + len(self), 0)
+        index = min(index, len(self))
+        list.insert(self, index, key)
+        if index < len(self) // 2:
+            # Moving the base renumbers the keys after the new one.
+            self._base -= 1
+            self._renumber(0, index + 1)
+        else:
+            self._renumber(index)
+
+    def remove(self, key):
+        self.pop(self.index(key))
+
+    def pop(self, index=-1):
+        if index < 0:
+            index += len(self)
+        key = list.pop(self, index)
+        del self._slot_of[key]
+        if index < len(self) // 2:
+            self._base += 1
+            self._renumber(0, index)
+        elif index < len(self):
+            self._renumber(index)
+        return key
+
+    def clear(self):
+        list.clear(self)
+        self._slot_of.clear()
+        self._base = 0
+
+    def copy(self):
+        return self.__class__(self)
+
+    def sort(self, *, key=None, reverse=False):
+        list.sort(self, key=key, reverse=reverse)
+        self._renumber(0)
+
+
+class OffsetList(OrderEngine):
+    """
+    An ordering engine for :class:`IndexedOrderedDict` that keeps free space
+    in front of the keys.  Removing or inserting the first key only moves the
+    head offset, so ``d.popitem(last=False)`` and
+    ``d.move_to_end(key, last=False)`` do not shift the whole order, while
+    positional access stays a plain list lookup.
+
+    Select it with ``d.set_engine("offset")``.
+    """
+
+    linear_index = True
+
+    def __init__(self, iterable=()):
+        self._slots = list(iterable)
+        self._head = 0
+
+    def _normalize(self, index):
+        size = len(self._slots) - self._head
+        if index < 0:
+            index += size
+        if not 0 <= index < size:
+            raise IndexError("list index out of range")
+        return index + self._head
+
+    def __len__(self):
+        return len(self._slots) - self._head
+
+    def __iter__(self):
+        return itertools.islice(self._slots, self._head, None)
+
+    def __reversed__(self):
+        return itertools.islice(reversed(self._slots), len(self))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step < 0:
+                return self._slots[self._head:][index]
+            return self._slots[self._head + start:self._head + max(start, stop):step]
+        return self._slots[self._normalize(index)]
+
+    def __delitem__(self, index):
+        if not isinstance(index, slice):
+            self.pop(index)
+            return
+        start, stop, step = index.indices(len(self))
+        if start == 0 and step == 1:
+            # Dropping a prefix of any length only moves the head offset.
+            self._drop_front(stop)
+        else:
+            slots = self._slots[self._head:]
+            del slots[index]
+            self._slots = slots
+            self._head = 0
+
+    def index(self, key):
+        return self._slots.index(key, self._head) - self._head
+
+    def append(self, key):
+        self._slots.append(key)
+
+    def extend(self, iterable):
+        self._slots.extend(iterable)
+
+    def insert(self, index, key):
+        if index < 0:
+            index = max(index + len(self), 0)
+        if index == 0:
+            if not self._head:
+                # Make room for as many keys as there are now.
+                self._head = max(len(self._slots), 8)
+                self._slots[0:0] = [None] * self._head
+            self._head -= 1
+            self._slots[self._head] = key
+        else:
+            self._slots.insert(self._head + index, key)
+
+    def remove(self, key):
+        self.pop(self.index(key))
+
+    def pop(self, index=-1):
+        slot = self._normalize(index)
+        if slot != self._head:
+            return self._slots.pop(slot)
+        key = self._slots[slot]
+        self._drop_front(1)
+        return key
+
+    def _drop_front(self, count):
+        self._head += count
+        if self._head > len(self._slots) // 2 + 8:
+            del self._slots[:self._head]
+            self._head = 0
+        else:
+            self._slots[self._head - count:self._head] = [None] * count
+
+    def clear(self):
+        self._slots.clear()
+        self._head = 0
+
+    def sort(self, *, key=None, reverse=False):
+        self._slots = sorted(self, key=key, reverse=reverse)
+        self._head = 0
+
+
+def _reversed_keys(mapping):
+    try:
+        return reversed(dict.keys(mapping))
+    except TypeError:
+        # Dictionary views are not reversible before Python 3.8.
+        return reversed(list(dict.keys(mapping)))
+
+
+class LazyList(OrderEngine):
+    """
+    An ordering engine for :class:`IndexedOrderedDict` that relies on the
+    insertion order of the underlying ``dict`` for as long as it matches.
+    Deleting keys then costs no more than in a plain ``dict``, rather than a
+    linear removal from a list.  The list of keys is only materialized on
+    the first access by position or ``index()``, kept in sync by appends and
+    dropped again by deletions.  Reordering
+    (``move_to_end()``, ``sort()``) makes the list permanent until the
+    dictionary is cleared.
+
+    Select it with ``d.set_engine("lazy")``.
+    """
+
+    linear_index = True
+
+    def __init__(self, iterable=()):
+        self._mapping = None
+        self._keys = list(iterable)
+        self._consistent = False
+
+    def _attach(self, mapping):
+        self._mapping = mapping
+        if self._keys == list(dict.keys(mapping)):
+            self._keys = None
+            self._consistent = True
+
+    def _materialize(self):
+        if self._keys is None:
+            self._keys = list(dict.keys(self._mapping))
+        return self._keys
+
+    def _reorder(self):
+        keys = self._materialize()
+        self._consistent = False
+        return keys
+
+    def __len__(self):
+        if self._keys is None:
+            return dict.__len__(self._mapping)
+        return len(self._keys)
+
+    def __iter__(self):
+        if self._keys is None:
+            return iter(dict.keys(self._mapping))
+        return iter(self._keys)
+
+    def __reversed__(self):
+        if self._keys is None:
+            return _reversed_keys(self._mapping)
+        return reversed(self._keys)
+
+    def __contains__(self, key):
+        if self._keys is None:
+            return dict.__contains__(self._mapping, key)
+        return key in self._keys
+
+    def __getitem__(self, index):
+        if self._keys is None and self._mapping:
+            if index == 0:
+                return next(iter(dict.keys(self._mapping)))
+            if index == -1:
+                return next(_reversed_keys(self._mapping))
+        return self._materialize()[index]
+
+    def index(self, key):
+        return self._materialize().index(key)
+
+    def append(self, key):
+        if self._keys is not None:
+            self._keys.append(key)
+
+    def extend(self, iterable):
+        if self._keys is not None:
+            self._keys.extend(iterable)
+
+    def insert(self, index, key):
+        self._reorder().insert(index, key)
+
+    def remove(self, key):
+        if self._consistent and not dict.__contains__(self._mapping, key):
+            # Deleted from the dictionary as well.
+            self._keys = None
+        else:
+            self._reorder().remove(key)
+
+    def pop(self, index=-1):
+        if not self._consistent:
+            return self._keys.pop(index)
+        # The dictionary removes the key itself.
+        key = self[index]
+        self._keys = None
+        return key
+
+    def clear(self):
+        self._keys = None
+        self._consistent = True
+
+    def copy(self):
+        return self.__class__(self)
+
+    def sort(self, *, key=None, reverse=False):
+        self._reorder().sort(key=key, reverse=reverse)
+
+
+class AdaptiveEngine(OrderEngine):
+    """
+    An ordering engine for :class:`IndexedOrderedDict` that counts the
+    operations it sees and migrates to another engine when its cost model
+    says the current one has become the bottleneck, e.g., from a plain list
+    to a :class:`TombstoneList` after many deletions in the middle.
+
+    Select it with ``d.set_engine("auto")``.
+    """
+
+    #: Number of operations between reconsidering the engine.
+    check_interval = 1024
+
+    def __init__(self, iterable=()):
+        self._engine = list(iterable)
+        self._reset()
+
+    def _reset(self):
+        self._ops = 0
+        self._cheap = 0
+        self._removes = 0
+        self._fronts = 0
+        self._lookups = 0
+
+    def _tick(self):
+        self._ops += 1
+        if self._ops >= self.check_interval:
+            self._adapt()
+
+    @staticmethod
+    def _costs(n):
+        """
+        Rough cost of (cheap, remove, front, lookup) operations for each
+        candidate engine.  Linear operations mostly run in C, so they are
+        weighted less than the Python-level logarithmic ones.
+        """
+        linear = n / 16
+        log = 4 * max(n.bit_length(), 1)
+        return {
+            list: (1, linear, linear / 4, linear),
+            PositionList: (1, linear / 2, linear, 1),
+            OffsetList: (1, linear, 1, linear),
+            TombstoneList: (log, log, log, log),
+        }
+
+    def _adapt(self):
+        n = len(self._engine)
+        counts = (self._cheap, self._removes, self._fronts, self._lookups)
+        self._reset()
+        costs = {
+            engine: sum(map(operator.mul, counts, cost))
+            for engine, cost in self._costs(n).items()
+        }
+        best = min(costs, key=costs.__getitem__)
+        current = type(self._engine)
+        # Only migrate if the saving pays for rebuilding the engine.
+        if best is not current and costs.get(current, 0) - costs[best] > n:
+            self._engine = best(self._engine)
+
+    @property
+    def linear_index(self):
+        return getattr(self._engine, "linear_index", True)
+
+    def __len__(self):
+        return len(self._engine)
+
+    def __iter__(self):
+        return iter(self._engine)
+
+    def __reversed__(self):
+        return reversed(self._engine)
+
+    def __contains__(self, key):
+        return key in self._engine
+
+    def __getitem__(self, index):
+        self._cheap += 1
+        self._tick()
+        return self._engine[index]
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, self._engine)
+
+    def index(self, key):
+        self._lookups += 1
+        self._tick()
+        return self._engine.index(key)
+
+    def append(self, key):
+        self._cheap += 1
+        self._tick()
+        self._engine.append(key)
+
+    def extend(self, iterable):
+        self._engine.extend(iterable)
+
+    def insert(self, index, key):
+        if index == 0:
+            self._fronts += 1
+        else:
+            self._removes += 1
+        self._tick()
+        self._engine.insert(index, key)
+
+    def remove(self, key):
+        self._removes += 1
+        self._tick()
+        self._engine.remove(key)
+
+    def pop(self, index=-1):
+        if index == 0:
+            self._fronts += 1
+        elif index == -1:
+            self._cheap += 1
+        else:
+            self._removes += 1
+        self._tick()
+        return self._engine.pop(index)
+
+    def clear(self):
+        self._engine.clear()
+
+    def copy(self):
+        new = self.__class__()
+        new._engine = self._engine.copy()
+        return new
+
+    def sort(self, *, key=None, reverse=False):
+        self._engine.sort(key=key, reverse=reverse)
+
+
+class SortedList(OrderEngine):
+    """
+    An ordering engine that keeps the keys sorted in a list of short blocks.
+    Keys are placed with ``add()`` by bisecting the last keys of the blocks
+    and then a single block, and block sizes are tracked in a Fenwick tree,
+    so adding, removing, positional access and rank queries are logarithmic
+    in the number of blocks plus linear in the block size.
+
+    ``append()`` and ``insert()`` only accept keys that keep the order.
+    This is the engine of :class:`SortedIndexedDict`.
+    """
+
+    _load = 512
+
+    def __init__(self, iterable=()):
+        self._reset(sorted(iterable))
+
+    def _reset(self, keys):
+        load = self._load
+        self._blocks = [keys[start:start + load] for start in range(0, len(keys), load)]
+        self._rebuild()
+
+    def _rebuild(self):
+        blocks = self._blocks = [block for block in self._blocks if block]
+        self._maxes = [block[-1] for block in blocks]
+        self._tree = _FenwickTree(map(len, blocks))
+        self._len = sum(map(len, blocks))
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        return itertools.chain.from_iterable(self._blocks)
+
+    def __reversed__(self):
+        return itertools.chain.from_iterable(map(reversed, reversed(self._blocks)))
+
+    def _iter_from(self, index):
+        if index >= self._len:
+            return iter(())
+        b, offset = self._tree.find(index)
+        rest = itertools.islice(self._blocks, b + 1, None)
+        return itertools.chain(self._blocks[b][offset:], itertools.chain.from_iterable(rest))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._len)
+            if step != 1:
+                return list(self)[index]
+            return list(itertools.islice(self._iter_from(start), max(stop - start, 0)))
+        b, offset = self._tree.find(self._normalize(index))
+        return self._blocks[b][offset]
+
+    def _find(self, key):
+        """Return the block and offset of *key*, or raise ValueError."""
+        b = bisect.bisect_left(self._maxes, key)
+        if b < len(self._maxes):
+            block = self._blocks[b]
+            offset = bisect.bisect_left(block, key)
+            if block[offset] == key:
+                return b, offset
+        raise ValueError("%r is not in list" % (key, ))
+
+    def __contains__(self, key):
+        try:
+            self._find(key)
+        except ValueError:
+            return False
+        return True
+
+    def index(self, key):
+        b, offset = self._find(key)
+        return self._tree.prefix(b) + offset
+
+    def bisect_left(self, key):
+        """Return the number of keys less than *key*."""
+        b = bisect.bisect_left(self._maxes, key)
+        if b == len(self._maxes):
+            return self._len
+        return self._tree.prefix(b) + bisect.bisect_left(self._blocks[b], key)
+
+    def bisect_right(self, key):
+        """Return the number of keys less than or equal to *key*."""
+        b = bisect.bisect_right(self._maxes, key)
+        if b == len(self._maxes):
+            return self._len
+        return self._tree.prefix(b) + bisect.bisect_right(self._blocks[b], key)
+
+    def irange(self, minimum=None, maximum=None, inclusive=(True, True)):
+        """
+        Iterate over the keys between *minimum* and *maximum*.  Either
+        bound may be None, i.e., unbounded.
+        """
+        if minimum is None:
+            start = 0
+        else:
+            start = self.bisect_left(minimum) if inclusive[0] else self.bisect_right(minimum)
+        if maximum is None:
+            stop = self._len
+        else:
+            stop = self.bisect_right(maximum) if inclusive[1] else self.bisect_left(maximum)
+        return itertools.islice(self._iter_from(start), max(stop - start, 0))
+
+    def add(self, key):
+        """Insert *key* at its sorted position."""
+        blocks, maxes = self._blocks, self._maxes
+        if not blocks:
+            self._reset([key])
+            return
+        b = bisect.bisect_left(maxes, key)
+        if b == len(maxes):
+            b -= 1
+            block = blocks[b]
+            block.append(key)
+            maxes[b] = key
+        else:
+            block = blocks[b]
+            bisect.insort(block, key)
+        if len(block) > 2 * self._load:
+            blocks.insert(b + 1, block[self._load:])
+            del block[self._load:]
+            self._rebuild()
+        else:
+            self._tree.add(b, 1)
+            self._len += 1
+
+    def append(self, key):
+        self.insert(self._len, key)
+
+    def insert(self, index, key):
+        if index < 0:
+            index = max(index + self._len, 0)
+        index = min(index, self._len)
+        if self.bisect_left(key) != index or self.bisect_right(key) != index:
+            raise ValueError("%r does not belong at position %d of a %s" % (key, index, self.__class__.__name__))
+        self.add(key)
+
+    def extend(self, iterable):
+        keys = list(iterable)
+        if len(keys) * 8 > self._len:
+            # Merging two sorted runs is linear, and cheaper than bisecting
+            # for a large batch.
+            self._reset(sorted(itertools.chain(self, keys)))
+        else:
+            added = []
+            try:
+                for key in keys:
+                    self.add(key)
+                    added.append(key)
+            except TypeError:
+                for key in added:
+                    self.remove(key)
+                raise
+
+    def _delete(self, b, offset):
+        block = self._blocks[b]
+        del block[offset]
+        if block:
+            self._maxes[b] = block[-1]
+            self._tree.add(b, -1)
+            self._len -= 1
+        else:
+            self._rebuild()
+
+    def remove(self, key):
+        self._delete(*self._find(key))
+
+    def pop(self, index=-1):
+        b, offset = self._tree.find(self._normalize(index))
+        key = self._blocks[b][offset]
+        self._delete(b, offset)
+        return key
+
+    def clear(self):
+        self._blocks.clear()
+        self._rebuild()
+
+    def sort(self, *, key=None, reverse=False):
+        if key is not None or reverse:
+            raise TypeError("%s is always sorted by key" % (self.__class__.__name__, ))
+
+
+#: Ordering engines by name, for use with ``d.set_engine(name)``.
+ENGINES = {
+    "list": list,
+    "position": PositionList,
+    "offset": OffsetList,
+    "deque": OffsetList,
+    "tree": BlockedList,
+    "tombstone": TombstoneList,
+    "lazy": LazyList,
+    "auto": AdaptiveEngine,
+}
+
+
+def _engine_class(engine):
+    if isinstance(engine, str):
+        try:
+            return ENGINES[engine]
+        except KeyError:
+            raise ValueError("unknown engine: %r" % (engine, )) from None
+    return engine
+
+
+class CompactIndexedOrderedDict(IndexedOrderedDict):
+    """
+    An indexed ordered dictionary that also keeps the values in an array
+    parallel to the keys, similar to the entries of CPython's compact dict.
+    Values and items are read by position with a single array lookup,
+    ``d.keys().index(key)`` is a hash lookup, and iterating over values does
+    not look up each key again.  The order is always kept by a
+    :class:`PositionList`.
+    """
+
+    def __init__(self, *args, **kwds):
+        if len(args) > 1:
+            raise TypeError('expected at most 1 arguments, got %d' % len(args))
+
+        self._map = PositionList()
+        self._values = []
+        self._order_token = None
+        self._version = 0
+        self._view_cache = {}
+        self.update(*args, **kwds)
+
+    def __setitem__(self, key, value, *, __dict_setitem=dict.__setitem__):
+        """iod.__setitem__(i, y) <==> iod[i] = y"""
+        if key in self:
+            self._values[self._map.index(key)] = value
+        else:
+            self._map.append(key)
+            self._values.append(value)
+            self._order_token = None
+        self._version += 1
+        __dict_setitem(self, key, value)
+        if self._observers:
+            _notify_set(self, key, value)
+
+    def __delitem__(self, key, *, __dict_delitem=dict.__delitem__):
+        """iod.__delitem__(y) <==> del iod[y]"""
+        __dict_delitem(self, key)
+        self._order_token = None
+        self._version += 1
+        if self._observers:
+            _notify_discard(self, key)
+        slot = self._map.index(key)
+        self._map.pop(slot)
+        del self._values[slot]
+
+    def clear(self):
+        """iod.clear() -> None.  Remove all items from iod."""
+        self._values.clear()
+        IndexedOrderedDict.clear(self)
+
+    def popitem(self, last=True):
+        """
+        iod.popitem() -> (k, v), return and remove a (key, value) pair.
+        Pairs are returned LIFO order if last is true or FIFI order if false.
+        """
+        slot = -1 if last else 0
+        key = self._map.pop(slot)
+        self._values.pop(slot)
+        self._order_token = None
+        self._version += 1
+        value = dict.pop(self, key)
+        if self._observers:
+            _notify_discard(self, key)
+        return key, value
+
+    def move_to_end(self, key, last=True):
+        """
+        Move an existing element to the end (or beginning if last==False).
+
+        Raises KeyError if the element does not exist.
+        """
+        slot = self._map.index(key)
+        self._map.pop(slot)
+        value = self._values.pop(slot)
+        self._order_token = None
+        self._version += 1
+        if last:
+            self._map.append(key)
+            self._values.append(value)
+        else:
+            self._map.insert(0, key)
+            self._values.insert(0, value)
+
+    def sort(self, *, key=None, reverse=False):
+        """Sort the dictionary by key in place."""
+        self._map.sort(key=key, reverse=reverse)
+        self._order_token = None
+        self._version += 1
+        self._values = list(map(functools.partial(dict.__getitem__, self), self._map))
+
+    def set_engine(self, engine):
+        if _engine_class(engine) is not PositionList:
+            raise ValueError("%s always uses the PositionList engine" % (self.__class__.__name__, ))
+
+    def copy(self):
+        """od.copy() -> a shallow copy of iod"""
+        new = IndexedOrderedDict.copy(self)
+        new._values = self._values.copy()
+        return new
+
+    __copy__ = copy
+
+    def values(self):
+        return CompactValuesView(self)
+
+    def items(self):
+        return CompactItemsView(self)
+
+
+CompactIndexedOrderedDict._internal_attributes = frozenset(vars(CompactIndexedOrderedDict())) | {"_observers"}
+
+CompactDict = CompactIndexedOrderedDict
+
+
+class CompactValuesView(IndexedValuesView):
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return IndexedSliceView(self, range(len(self))[index])
+        return self._mapping._values[index]
+
+    def _iter_positions(self, positions):
+        return map(self._mapping._values.__getitem__, positions)
+
+    def __iter__(self):
+        return _guarded(self._mapping, iter(self._mapping._values))
+
+    def __reversed__(self):
+        return _guarded(self._mapping, reversed(self._mapping._values))
+
+    def tolist(self):
+        return list(self._mapping._values)
+
+
+class CompactItemsView(IndexedItemsView):
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return IndexedSliceView(self, range(len(self))[index])
+        return self._mapping._map[index], self._mapping._values[index]
+
+    def _iter_positions(self, positions):
+        keys, values = itertools.tee(positions)
+        return zip(map(self._mapping._map.__getitem__, keys), map(self._mapping._values.__getitem__, values))
+
+    def __iter__(self):
+        return _guarded(self._mapping, zip(self._mapping._map, self._mapping._values))
+
+    def __reversed__(self):
+        return _guarded(self._mapping, zip(reversed(self._mapping._map), reversed(self._mapping._values)))
+
+    def tolist(self):
+        return list(zip(self._mapping._map, self._mapping._values))
+
+
+class BoundedIndexedOrderedDict(IndexedOrderedDict):
+    """
+    An indexed ordered dictionary that holds at most *maxlen* items.  Like
+    ``collections.deque(iterable, maxlen)``, it is filled from *iterable*,
+    a mapping or an iterable of pairs, and inserting a new key into a full
+    dictionary evicts the oldest item in constant time.  If ``on_evict``
+    is set, it is called with the key and value of every evicted item.
+    The order is kept by an :class:`OffsetList` unless another engine is
+    selected.
+    """
+
+    def __init__(self, iterable=(), maxlen=None, **kwds):
+        if maxlen is not None and maxlen < 0:
+            raise ValueError("maxlen must be non-negative")
+        self.maxlen = maxlen
+        self.on_evict = None
+        IndexedOrderedDict.__init__(self)
+        self.set_engine(OffsetList)
+        self.update(iterable, **kwds)
+
+    def __setitem__(self, key, value):
+        """iod.__setitem__(i, y) <==> iod[i] = y"""
+        IndexedOrderedDict.__setitem__(self, key, value)
+        if self.maxlen is not None and dict.__len__(self) > self.maxlen:
+            evicted = self.popitem(last=False)
+            if self.on_evict is not None:
+                self.on_evict(*evicted)
+
+    def copy(self):
+        """od.copy() -> a shallow copy of iod"""
+        new = IndexedOrderedDict.copy(self)
+        new.maxlen = self.maxlen
+        new.on_evict = self.on_evict
+        return new
+
+    __copy__ = copy
+
+    def map_values(self, fn, executor=None, chunksize=1):
+        """
+        Return a new dictionary with the same bound, keys and order, and
+        ``fn(value)`` as values.  See :meth:`IndexedOrderedDict.map_values`.
+        """
+        new = IndexedOrderedDict.map_values(self, fn, executor, chunksize)
+        new.maxlen = self.maxlen
+        new.on_evict = self.on_evict
+        return new
+
+    def __or__(self, other):
+        if not isinstance(other, dict):
+            return NotImplemented
+        # Items evicted while building the result were never in self.
+        new = self.copy()
+        new.on_evict = None
+        new.update(other)
+        new.on_evict = self.on_evict
+        return new
+
+    def __ror__(self, other):
+        if not isinstance(other, dict):
+            return NotImplemented
+        new = self.copy()
+        new.on_evict = None
+        new.clear()
+        new.update(other)
+        new.update(self)
+        new.on_evict = self.on_evict
+        return new
+
+    @reprlib.recursive_repr()
+    def __repr__(self):
+        """iod.__repr__() <==> repr(iod)"""
+        return '%s(%r, maxlen=%r)' % (self.__class__.__name__, list(self.items()), self.maxlen)
+
+
+BoundedDict = BoundedIndexedOrderedDict
+
+
+class ExpiringIndexedOrderedDict(IndexedOrderedDict):
+    """
+    An indexed ordered dictionary whose items expire *ttl* seconds after
+    their keys were inserted, as measured by *clock*, which must not go
+    backwards.  Reassigning a key keeps its expiry, ``d.move_to_end(key)``
+    renews it.
+
+    Since keys expire in insertion order, expired items are always at the
+    front.  They are purged lazily, all at once, whenever the order is
+    accessed, so positional reads such as ``d.keys()[0]`` never see them,
+    and looking up an expired key raises KeyError.  The order is always
+    kept by an :class:`OffsetList`, which drops any number of keys from the
+    front by moving its head offset.
+    """
+
+    def __init__(self, ttl, clock=time.monotonic):
+        if ttl < 0:
+            raise ValueError("ttl must be non-negative")
+        self.ttl = ttl
+        self.clock = clock
+        self._deadlines = {}
+        IndexedOrderedDict.__init__(self)
+        self._order = OffsetList()
+
+    @property
+    def _map(self):
+        # Every positional read goes through here, so this is where
+        # expired keys are purged.
+        self._expire()
+        return self._order
+
+    @_map.setter
+    def _map(self, engine):
+        self._order = engine
+
+    def _expire(self):
+        order = self._order
+        if not order:
+            return
+        deadlines = self._deadlines
+        now = self.clock()
+        if deadlines[order[0]] > now:
+            return
+        lo, hi = 1, len(order)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if deadlines[order[mid]] <= now:
+                lo = mid + 1
+            else:
+                hi = mid
+        expired = order[:lo]
+        del order[:lo]
+        for key in expired:
+            dict.__delitem__(self, key)
+            del deadlines[key]
+            if self._observers:
+                _notify_discard(self, key)
+        self._order_token = None
+        self._version += 1
+
+    def _alive(self, key):
+        return dict.__contains__(self, key) and self._deadlines[key] > self.clock()
+
+    def __getitem__(self, key):
+        if not self._alive(key):
+            raise KeyError(key)
+        return dict.__getitem__(self, key)
+
+    def __contains__(self, key):
+        return self._alive(key)
+
+    def get(self, key, default=None):
+        """D.get(k[,d]) -> D[k] if k in D and has not expired, else d."""
+        if self._alive(key):
+            return dict.__getitem__(self, key)
+        return default
+
+    def __len__(self):
+        self._expire()
+        return dict.__len__(self)
+
+    def __eq__(self, other):
+        """
+        Compare the items that have not expired, like
+        :meth:`IndexedOrderedDict.__eq__`.
+        """
+        self._expire()
+        if isinstance(other, ExpiringIndexedOrderedDict):
+            other._expire()
+        return IndexedOrderedDict.__eq__(self, other)
+
+    def __setitem__(self, key, value):
+        """iod.__setitem__(i, y) <==> iod[i] = y"""
+        self._expire()
+        if not dict.__contains__(self, key):
+            self._order.append(key)
+            self._deadlines[key] = self.clock() + self.ttl
+            self._order_token = None
+        self._version += 1
+        dict.__setitem__(self, key, value)
+        if self._observers:
+            _notify_set(self, key, value)
+
+    def __delitem__(self, key):
+        """iod.__delitem__(y) <==> del iod[y]"""
+        self._expire()
+        dict.__delitem__(self, key)
+        del self._deadlines[key]
+        self._order.remove(key)
+        self._order_token = None
+        self._version += 1
+        if self._observers:
+            _notify_discard(self, key)
+
+    def popitem(self, last=True):
+        """
+        iod.popitem() -> (k, v), return and remove a (key, value) pair.
+        Pairs are returned LIFO order if last is true or FIFI order if false.
+        """
+        key, value = IndexedOrderedDict.popitem(self, last)
+        del self._deadlines[key]
+        return key, value
+
+    def clear(self):
+        """iod.clear() -> None.  Remove all items from iod."""
+        IndexedOrderedDict.clear(self)
+        self._deadlines.clear()
+
+    def move_to_end(self, key, last=True):
+        """
+        Move an existing element to the end and renew its expiry.  Moving
+        it to the beginning is not supported, since keys expire in order.
+        """
+        if not last:
+            raise TypeError("%s keeps keys in order of expiry" % (self.__class__.__name__, ))
+        if key not in self:
+            raise KeyError(key)
+        IndexedOrderedDict.move_to_end(self, key)
+        self._deadlines[key] = self.clock() + self.ttl
+
+    def sort(self, *, key=None, reverse=False):
+        raise TypeError("%s keeps keys in order of expiry" % (self.__class__.__name__, ))
+
+    def set_engine(self, engine):
+        if _engine_class(engine) is not OffsetList:
+            raise ValueError("%s always uses the OffsetList engine" % (self.__class__.__name__, ))
+
+    def _remaining(self):
+        now = self.clock()
+        keys = list(self._map)
+        values = list(map(_lookup(self), keys))
+        return keys, values, [self._deadlines[key] - now for key in keys]
+
+    def copy(self):
+        """od.copy() -> a shallow copy of iod"""
+        return _restore_expiring(self.__class__, self.ttl, self.clock, *self._remaining())
+
+    __copy__ = copy
+
+    def map_values(self, fn, executor=None, chunksize=1):
+        """
+        Return a new dictionary with the same keys, order and expiry, and
+        ``fn(value)`` as values.  See :meth:`IndexedOrderedDict.map_values`.
+        """
+        keys, results = _map_values(self, fn, executor, chunksize)
+        now = self.clock()
+        remaining = [self._deadlines[key] - now for key in keys]
+        return _restore_expiring(self.__class__, self.ttl, self.clock, keys, results, remaining)
+
+    def __reduce__(self):
+        """Return state information for pickling"""
+        return _restore_expiring, (self.__class__, self.ttl, self.clock) + self._remaining()
+
+    @reprlib.recursive_repr()
+    def __repr__(self):
+        """iod.__repr__() <==> repr(iod)"""
+        return '%s(%r, %r)' % (self.__class__.__name__, self.ttl, list(self.items()))
+
+    def keys(self):
+        return ExpiringKeysView(self)
+
+    def values(self):
+        return ExpiringValuesView(self)
+
+    def items(self):
+        return ExpiringItemsView(self)
+
+
+class ExpiringKeysView(IndexedKeysView):
+    def __contains__(self, key):
+        return key in self._mapping
+
+    def _native(self):
+        self._mapping._expire()
+        return super()._native()
+
+
+class ExpiringValuesView(IndexedValuesView):
+    def __contains__(self, value):
+        self._mapping._expire()
+        return super().__contains__(value)
+
+    def _materialize(self):
+        # Purge first, so that the cache is checked against the new version.
+        self._mapping._expire()
+        return super()._materialize()
+
+
+class ExpiringItemsView(IndexedItemsView):
+    def __contains__(self, item):
+        self._mapping._expire()
+        return super().__contains__(item)
+
+    def _materialize(self):
+        self._mapping._expire()
+        return super()._materialize()
+
+    def _native(self):
+        self._mapping._expire()
+        return super()._native()
+
+
+def _restore_expiring(cls, ttl, clock, keys, values, remaining):
+    """
+    Rebuild an expiring dictionary.  Lifetimes are stored relative to the
+    clock, which may have a different origin in another process.
+    """
+    self = cls(ttl, clock)
+    now = clock()
+    dict.update(self, zip(keys, values))
+    self._order.extend(keys)
+    self._deadlines.update(zip(keys, [now + left for left in remaining]))
+    return self
+
+
+ExpiringDict = ExpiringIndexedOrderedDict
+
+
+class SortedIndexedDict(IndexedOrderedDict):
+    """
+    A dictionary that keeps its keys sorted instead of in insertion order.
+    The order is kept by a :class:`SortedList`, so inserting and deleting
+    keys, ``d.keys()[i]``, ``d.keys().index(key)`` and
+    ``d.keys().bisect_left(key)`` take logarithmic time, and ``d.irange()``
+    iterates over a range of keys.  All keys must be comparable with each
+    other.
+    """
+
+    def __init__(self, *args, **kwds):
+        if len(args) > 1:
+            raise TypeError('expected at most 1 arguments, got %d' % len(args))
+
+        self._map = SortedList()
+        self._order_token = None
+        self._version = 0
+        self._view_cache = {}
+        self.update(*args, **kwds)
+
+    def __setitem__(self, key, value, *, __dict_setitem=dict.__setitem__):
+        """sd.__setitem__(i, y) <==> sd[i] = y"""
+        if key not in self:
+            self._map.add(key)
+            self._order_token = None
+        self._version += 1
+        __dict_setitem(self, key, value)
+        if self._observers:
+            _notify_set(self, key, value)
+
+    def __delitem__(self, key, *, __dict_delitem=dict.__delitem__):
+        """sd.__delitem__(y) <==> del sd[y]"""
+        __dict_delitem(self, key)
+        self._order_token = None
+        self._version += 1
+        if self._observers:
+            _notify_discard(self, key)
+        self._map.remove(key)
+
+    def update(self, *args, **kwds):
+        """
+        sd.update([E, ]**F) -> None.  Update sd from dict/iterable E and F.
+        New keys are merged into the order in one pass.
+        """
+        if len(args) > 1:
+            raise TypeError('update expected at most 1 argument, got %d' % len(args))
+        for other in args + (kwds, ):
+            if not isinstance(other, dict):
+                other = dict(other)
+            new_keys = list(itertools.filterfalse(self.__contains__, other))
+            # Extend the order first, so that incomparable keys leave the
+            # dictionary unchanged.
+            self._map.extend(new_keys)
+            dict.update(self, other)
+            self._version += 1
+            if new_keys:
+                self._order_token = None
+            if self._observers:
+                for key, value in other.items():
+                    _notify_set(self, key, value)
+
+    def irange(self, minimum=None, maximum=None, inclusive=(True, True)):
+        """
+        Iterate over the keys from *minimum* to *maximum* in sorted order.
+        Either bound may be None, i.e., unbounded, and ``inclusive`` tells
+        whether the bounds themselves are included.
+        """
+        return _guarded(self, self._map.irange(minimum, maximum, inclusive))
+
+    def move_to_end(self, key, last=True):
+        raise TypeError("%s keeps its keys sorted" % (self.__class__.__name__, ))
+
+    def sort(self, *, key=None, reverse=False):
+        raise TypeError("%s keeps its keys sorted" % (self.__class__.__name__, ))
+
+    def set_engine(self, engine):
+        if _engine_class(engine) is not SortedList:
+            raise ValueError("%s always uses the SortedList engine" % (self.__class__.__name__, ))
+
+    def keys(self):
+        return SortedKeysView(self)
+
+
+class SortedKeysView(IndexedKeysView):
+    def bisect_left(self, key):
+        """Return the number of keys less than *key*."""
+        return self._mapping._map.bisect_left(key)
+
+    def bisect_right(self, key):
+        """Return the number of keys less than or equal to *key*."""
+        return self._mapping._map.bisect_right(key)
+
+
+SortedDict = SortedIndexedDict
+
+
+class SortedValuesView(collections.abc.Sequence):
+    """
+    The items of a dictionary sorted by value, as returned by
+    ``d.sorted_values_view(key)``.  The dictionary notifies the view of
+    every change, which moves the affected item within a
+    :class:`SortedList`.  Values, or ``key(value)``, must be comparable.
+    """
+
+    def __init__(self, mapping, key=None):
+        self._mapping = mapping
+        self._key = key
+        self._serial = itertools.count()
+        self._reset()
+
+    def _entry(self, key, value):
+        # The serial number breaks ties, so that dictionary keys are never
+        # compared.
+        return value if self._key is None else self._key(value), next(self._serial), key
+
+    def _reset(self):
+        self._entries = {key: self._entry(key, value) for key, value in dict.items(self._mapping)}
+        self._order = SortedList(self._entries.values())
+
+    def _set(self, key, value):
+        entry = self._entry(key, value)
+        old = self._entries.get(key)
+        if old is not None:
+            if old[0] == entry[0]:
+                return
+            self._order.remove(old)
+        self._order.add(entry)
+        self._entries[key] = entry
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._order.remove(entry)
+
+    def _item(self, entry):
+        key = entry[2]
+        return key, dict.__getitem__(self._mapping, key)
+
+    def _purge(self):
+        # Dictionaries that drop items lazily, such as expiring ones, notify
+        # the view when they do.
+        expire = getattr(self._mapping, "_expire", None)
+        if expire is not None:
+            expire()
+
+    def __len__(self):
+        self._purge()
+        return len(self._order)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return IndexedSliceView(self, range(len(self))[index])
+        self._purge()
+        return self._item(self._order[index])
+
+    def _iter_positions(self, positions):
+        self._purge()
+        return map(self._item, map(self._order.__getitem__, positions))
+
+    def __iter__(self):
+        self._purge()
+        return self._guarded(iter(self._order))
+
+    def __reversed__(self):
+        self._purge()
+        return self._guarded(reversed(self._order))
+
+    def _guarded(self, entries):
+        # Like _guarded(), but changing a value moves its item, so any
+        # modification is an error once the iterator is exhausted.
+        entries = itertools.compress(entries, dict.items(self._mapping))
+        iterator = map(self._item, entries)
+        return itertools.chain(iterator, _check_version(self._mapping, self._mapping._version))
+
+    def __contains__(self, item):
+        self._purge()
+        return item in dict.items(self._mapping)
+
+    def rank(self, key):
+        """Return the position of the item with the given key."""
+        self._purge()
+        return self._order.index(self._entries[key])
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, list(self))
+
+
+class _IndexedCache(IndexedOrderedDict):
+    """
+    Base class for caches whose order reflects how the keys are used.
+    Subclasses place keys with the ``_insert(key)`` and ``_promote(key)``
+    hooks.
+    Capacity is measured in entries, or by ``weigher(key, value)`` if given.
+    Looking up a key with ``cache[key]`` or ``cache.get(key)`` and
+    assigning it count as uses, while ``cache.peek(key)``, iteration and the
+    views do not.  Since ``dict(cache)`` looks up every key, copy a cache
+    with ``cache.copy()``, ``IndexedOrderedDict(cache)`` or
+    ``dict(cache.items())`` to leave its order alone.  Least valuable
+    entries are kept at the end and evicted first.
+    """
+
+    _engine = TombstoneList
+
+    def __init__(self, capacity=128, weigher=None):
+        if capacity < 0:
+            raise ValueError("capacity must be non-negative")
+        self.capacity = capacity
+        self.weigher = weigher
+        self.weight = 0
+        self._weights = {}
+        IndexedOrderedDict.__init__(self)
+        self.set_engine(self._engine)
+
+    def _remove(self, key):
+        self._map.remove(key)
+
+    def _weigh(self, key, value):
+        weight = 1 if self.weigher is None else self.weigher(key, value)
+        if self.weigher is not None:
+            self._weights[key] = weight
+        self.weight += weight
+
+    def _unweigh(self, key):
+        self.weight -= self._weights.pop(key) if self.weigher is not None else 1
+
+    def __getitem__(self, key):
+        """cache.__getitem__(y) <==> cache[y].  Counts as a use."""
+        value = dict.__getitem__(self, key)
+        self._promote(key)
+        self._order_token = None
+        self._version += 1
+        return value
+
+    def get(self, key, default=None):
+        """
+        cache.get(k[,d]) -> cache[k] if k in cache, else d.  Counts as a use.
+        """
+        if not dict.__contains__(self, key):
+            return default
+        return self[key]
+
+    def peek(self, key, default=None):
+        """Like get(), but does not count as a use."""
+        return dict.get(self, key, default)
+
+    def __setitem__(self, key, value):
+        """cache.__setitem__(i, y) <==> cache[i] = y"""
+        if dict.__contains__(self, key):
+            self._unweigh(key)
+            dict.__setitem__(self, key, value)
+            self._promote(key)
+        else:
+            dict.__setitem__(self, key, value)
+            self._insert(key)
+        self._weigh(key, value)
+        self._order_token = None
+        self._version += 1
+        if self._observers:
+            _notify_set(self, key, value)
+        while self.weight > self.capacity:
+            self.popitem()
+
+    def __delitem__(self, key):
+        """cache.__delitem__(y) <==> del cache[y]"""
+        dict.__delitem__(self, key)
+        self._remove(key)
+        self._unweigh(key)
+        self._order_token = None
+        self._version += 1
+        if self._observers:
+            _notify_discard(self, key)
+
+    def popitem(self, last=True):
+        """
+        cache.popitem() -> (k, v), remove and return the least valuable
+        entry, or the most valuable one if last is false.
+        """
+        key = self._map[-1 if last else 0]
+        value = dict.__getitem__(self, key)
+        del self[key]
+        return key, value
+
+    def clear(self):
+        """cache.clear() -> None.  Remove all entries."""
+        IndexedOrderedDict.clear(self)
+        self._weights.clear()
+        self.weight = 0
+
+    def copy(self):
+        """cache.copy() -> a shallow copy of cache"""
+        new = self.__class__(self.capacity, self.weigher)
+        keys = list(self._map)
+        new._load(keys, list(map(_lookup(self), keys)), self._extra_state())
+        return new
+
+    __copy__ = copy
+
+    def map_values(self, fn, executor=None, chunksize=1):
+        """
+        Return a new cache with the same capacity, keys, order and use
+        counts, and ``fn(value)`` as values.  See
+        :meth:`IndexedOrderedDict.map_values`.
+        """
+        keys, results = _map_values(self, fn, executor, chunksize)
+        new = self.__class__(self.capacity, self.weigher)
+        new._load(keys, results, self._extra_state())
+        while new.weight > new.capacity:
+            new.popitem()
+        return new
+
+    def _extra_state(self):
+        return None
+
+    def _load(self, keys, values, extra):
+        """Fill an empty cache with entries in their current order."""
+        dict.update(self, zip(keys, values))
+        self._map.extend(keys)
+        for key, value in zip(keys, values):
+            self._weigh(key, value)
+
+    def __reduce__(self):
+        """Return state information for pickling"""
+        keys = list(self._map)
+        values = list(map(_lookup(self), keys))
+        args = (self.__class__, self.capacity, self.weigher, keys, values, self._extra_state())
+        return _restore_cache, args
+
+    @reprlib.recursive_repr()
+    def __repr__(self):
+        """cache.__repr__() <==> repr(cache)"""
+        return '%s(%r, %r)' % (self.__class__.__name__, self.capacity, list(self.items()))
+
+
+def _restore_cache(cls, capacity, weigher, keys, values, extra):
+    self = cls(capacity, weigher)
+    self._load(keys, values, extra)
+    return self
+
+
+class LRUCache(_IndexedCache):
+    """
+    A least recently used cache.  The most recently used entry comes
+    first, so ``cache.keys()[i]`` is the *i*-th most recently used key and
+    ``cache.keys().index(key)`` is its recency rank.  Hits and evictions
+    take logarithmic time.
+    """
+
+    def _promote(self, key):
+        self._map.remove(key)
+        self._map.insert(0, key)
+
+    def _insert(self, key):
+        self._map.insert(0, key)
+
+
+class LFUCache(_IndexedCache):
+    """
+    A least frequently used cache.  Entries are ordered by use count, most
+    frequently used first, and by recency among equal counts, so
+    ``cache.keys()[i]`` is the *i*-th most frequently used key.  Hits and
+    evictions take logarithmic time.
+    """
+
+    _engine = BlockedList
+
+    def __init__(self, capacity=128, weigher=None):
+        self._counts = {}
+        self._first = {}
+        super().__init__(capacity, weigher)
+
+    def use_count(self, key):
+        """Return how often *key* has been used since it was inserted."""
+        return self._counts[key]
+
+    def _detach(self, key):
+        """
+        Remove *key* from the order, keeping the bucket heads in sync.
+        Return its count and former position.
+        """
+        count = self._counts[key]
+        position = self._map.index(key)
+        self._map.remove(key)
+        if self._first[count] == key:
+            if position < len(self._map) and self._counts[self._map[position]] == count:
+                self._first[count] = self._map[position]
+            else:
+                del self._first[count]
+        return count, position
+
+    def _place(self, key, count, position):
+        self._map.insert(position, key)
+        self._first[count] = key
+        self._counts[key] = count
+
+    def _promote(self, key):
+        count, position = self._detach(key)
+        # Buckets are ordered by descending count, so the key goes to the
+        # front of the next bucket, i.e., before the rest of its old one.
+        head = self._first.get(count + 1)
+        if head is None:
+            head = self._first.get(count)
+        if head is not None:
+            position = self._map.index(head)
+        self._place(key, count + 1, position)
+
+    def _insert(self, key):
+        head = self._first.get(1)
+        self._place(key, 1, len(self._map) if head is None else self._map.index(head))
+
+    def _remove(self, key):
+        self._detach(key)
+        del self._counts[key]
+
+    def clear(self):
+        """cache.clear() -> None.  Remove all entries."""
+        super().clear()
+        self._counts.clear()
+        self._first.clear()
+
+    def move_to_end(self, key, last=True):
+        raise TypeError("the order of %s is determined by use counts" % (self.__class__.__name__, ))
+
+    def sort(self, *, key=None, reverse=False):
+        raise TypeError("the order of %s is determined by use counts" % (self.__class__.__name__, ))
+
+    def _extra_state(self):
+        return list(map(self._counts.__getitem__, self._map))
+
+    def _load(self, keys, values, extra):
+        super()._load(keys, values, extra)
+        self._counts.update(zip(keys, extra))
+        self._first.update(zip(reversed(extra), reversed(keys)))
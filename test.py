@@ -1,8 +1,14 @@
 #!/usr/bin/env python
 
 import unittest
+import collections
+import concurrent.futures
+import copy
 import indexed
+import operator
 import pickle
+import random
+import sys
 
 
 class IndexedOrderedDictTestCase(unittest.TestCase):
@@ -128,6 +134,114 @@ class IndexedOrderedDictTestCase(unittest.TestCase):
         reordered_a.move_to_end("foo")
         self.assertNotEqual(a, reordered_a)
 
+    def test_equality_order_token(self):
+        a = indexed.IndexedOrderedDict.fromkeys("abc")
+        b = indexed.IndexedOrderedDict.fromkeys("abc")
+        self.assertIsNone(a._order_token)
+        self.assertEqual(a, b)
+        self.assertIs(a._order_token, b._order_token)
+        self.assertEqual(a.copy()._order_token, a._order_token)
+
+        b.move_to_end("a")
+        b.move_to_end("b")
+        b.move_to_end("c")
+        self.assertIsNone(b._order_token)
+        self.assertEqual(a, b)
+
+        a["a"] = 1
+        self.assertNotEqual(a, b)
+        b["a"] = 1
+        del a["b"]
+        a["b"] = None
+        self.assertNotEqual(a, b)
+        self.assertNotEqual(a, indexed.IndexedOrderedDict.fromkeys("ab"))
+
+        b.set_engine("tree")
+        b.move_to_end("b")
+        self.assertEqual(a, b)
+        self.assertEqual(b, a)
+
+    def test_mutation_during_iteration(self):
+        d = indexed.IndexedOrderedDict.fromkeys("abc", 0)
+        for key in d:
+            d[key] += 1
+        self.assertEqual(list(d.values()), [1, 1, 1])
+        with self.assertRaises(RuntimeError):
+            for key in d:
+                d[key + key] = 0
+        with self.assertRaises(RuntimeError):
+            for key, value in d.items():
+                d.move_to_end(key)
+        with self.assertRaises(RuntimeError):
+            for value in reversed(d.values()):
+                d.popitem()
+
+        d = indexed.IndexedOrderedDict.fromkeys(range(5))
+        seen = []
+        with self.assertRaises(RuntimeError):
+            for key in d:
+                seen.append(key)
+                if key == 1:
+                    del d[2]
+                if key == 3:
+                    break
+        self.assertEqual(seen, [0, 1])
+        items = iter(d.items())
+        self.assertEqual(next(items), (0, None))
+        d[5] = None
+        self.assertRaises(RuntimeError, next, items)
+        for view in d.values(), d.items():
+            iterator = iter(view)
+            next(iterator)
+            del d[1]
+            self.assertRaises(RuntimeError, next, iterator)
+            d[1] = None
+
+    def test_iteration_runs_in_c(self):
+        d = indexed.IndexedOrderedDict.fromkeys(range(1000), 0)
+        for view in d, d.keys(), d.values(), d.items(), reversed(d.items()):
+            iterator = iter(view)
+            calls = []
+            sys.setprofile(lambda frame, event, arg: event == "call" and calls.append(frame))
+            try:
+                self.assertEqual(len(list(iterator)), 1000)
+            finally:
+                sys.setprofile(None)
+            self.assertLess(len(calls), 5)
+
+    def test_view_cache(self):
+        d = indexed.IndexedOrderedDict.fromkeys("abc", 0)
+        values = d.values()
+        self.assertEqual(list(values), [0, 0, 0])
+        self.assertEqual(d._view_cache["values"][1], [0, 0, 0])
+        d["a"] = 0
+        self.assertEqual(values.tolist(), [0, 0, 0])
+        cached = d._view_cache["values"][1]
+        self.assertIs(indexed._cached(d, "values"), cached)
+        self.assertEqual(list(values), [0, 0, 0])
+        self.assertIsNot(values.tolist(), cached)
+        d["b"] = 1
+        self.assertIsNone(indexed._cached(d, "values"))
+        self.assertEqual(list(values), [0, 1, 0])
+        self.assertEqual(d.items().tolist(), [("a", 0), ("b", 1), ("c", 0)])
+        self.assertEqual(list(reversed(d.items())), [("c", 0), ("b", 1), ("a", 0)])
+        d.move_to_end("a")
+        self.assertEqual(d.items().tolist(), [("b", 1), ("c", 0), ("a", 0)])
+        self.assertEqual(d.keys().tolist(), ["b", "c", "a"])
+
+    def test_map_values(self):
+        d = indexed.IndexedOrderedDict((str(i), i) for i in range(100))
+        d.move_to_end("0")
+        d.set_engine("tombstone")
+        doubled = d.map_values(lambda value: 2 * value)
+        self.assertEqual(list(doubled.keys()), list(d.keys()))
+        self.assertEqual(doubled.values()[-1], 0)
+        self.assertEqual(doubled["50"], 100)
+        self.assertIs(doubled.engine, indexed.TombstoneList)
+        with concurrent.futures.ThreadPoolExecutor(4) as executor:
+            negated = d.map_values(operator.neg, executor, chunksize=16)
+        self.assertEqual(list(negated.items()), [(key, -value) for key, value in d.items()])
+
     def test_pickle(self):
         d = indexed.IndexedOrderedDict()
         d["foo"] = "bar"
@@ -138,6 +252,15 @@ class IndexedOrderedDictTestCase(unittest.TestCase):
 
         self.assertEqual(d, unpickled)
 
+        d.set_engine(indexed.BlockedList)
+        d.attribute = "value"
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            unpickled = pickle.loads(pickle.dumps(d, protocol))
+            self.assertEqual(d, unpickled)
+            self.assertIsInstance(unpickled._map, indexed.BlockedList)
+            self.assertEqual(unpickled.attribute, "value")
+            self.assertEqual(unpickled.keys().index("bar"), 1)
+
     def test_from_keys(self):
         d = indexed.IndexedOrderedDict.fromkeys({
             "key-a": "a",
@@ -147,6 +270,30 @@ class IndexedOrderedDictTestCase(unittest.TestCase):
         self.assertEqual(d["key-a"], "default-value")
         self.assertEqual(d["key-b"], "default-value")
 
+    def test_copy(self):
+        d = indexed.IndexedOrderedDict([("b", 1), ("a", 2)])
+        d.set_engine(indexed.PositionList)
+        for c in [d.copy(), copy.copy(d)]:
+            self.assertEqual(c, d)
+            self.assertIsInstance(c, indexed.IndexedOrderedDict)
+            self.assertIsInstance(c._map, indexed.PositionList)
+            self.assertIsNot(c._map, d._map)
+            c["c"] = 3
+            self.assertEqual(c.keys().index("c"), 2)
+            self.assertNotIn("c", d)
+            self.assertNotIn("c", d._map)
+
+        class Counting(indexed.IndexedOrderedDict):
+            def __getitem__(self, key):
+                calls.append(key)
+                return super().__getitem__(key)
+
+        calls = []
+        d = Counting(a=1, b=2)
+        self.assertEqual(list(d.copy().items()), [("a", 1), ("b", 2)])
+        self.assertEqual(list(indexed.IndexedOrderedDict(d).items()), [("a", 1), ("b", 2)])
+        self.assertEqual(calls, [])
+
     def test_sort(self):
         forwards = indexed.IndexedOrderedDict([("a", 1), ("b", -1)])
         backwards = indexed.IndexedOrderedDict([("b", -1), ("a", 1)])
@@ -172,6 +319,409 @@ class IndexedOrderedDictTestCase(unittest.TestCase):
         foo |= bar
         self.assertEqual(foo, foo_bar)
 
+    def test_update(self):
+        d = indexed.IndexedOrderedDict([("a", 1), ("b", 2)])
+        d.update({"c": 3, "a": 4})
+        d.update(indexed.IndexedOrderedDict([("e", 5), ("d", 6)]))
+        d.update(collections.OrderedDict([("b", 7), ("f", 8)]))
+        d.update([("g", 9), ("h", 10), ("g", 11)], i=12, a=13)
+        d.update(collections.ChainMap({"j": 14}))
+        self.assertEqual(list(d.items()), [
+            ("a", 13), ("b", 7), ("c", 3), ("e", 5), ("d", 6),
+            ("f", 8), ("g", 11), ("h", 10), ("i", 12), ("j", 14)])
+        self.assertEqual(d.keys().index("j"), 9)
+        source = indexed.IndexedOrderedDict([("x", 1), ("y", 2)])
+        source.move_to_end("x")
+        for engine in indexed.ENGINES.values():
+            target = indexed.IndexedOrderedDict()
+            target.set_engine(engine)
+            target.update(source)
+            self.assertEqual(list(target.items()), [("y", 2), ("x", 1)])
+        self.assertRaises(TypeError, d.update, {}, {})
+        self.assertRaises(ValueError, d.update, ["k", "lm"])
+        self.assertEqual(len(d), len(d._map))
+
+    def test_sorted_values_view(self):
+        for cls in indexed.IndexedOrderedDict, indexed.CompactIndexedOrderedDict, indexed.SortedIndexedDict:
+            d = cls(a=3, b=1, c=2)
+            scores = d.sorted_values_view()
+            by_distance = d.sorted_values_view(key=lambda value: abs(value - 2))
+            self.assertEqual(list(scores), [("b", 1), ("c", 2), ("a", 3)])
+            d["d"] = 0
+            d["b"] = 5
+            d.update(e=2, a=-1)
+            del d["c"]
+            self.assertEqual(list(scores), [("a", -1), ("d", 0), ("e", 2), ("b", 5)])
+            self.assertEqual(scores[-1], ("b", 5))
+            self.assertEqual(list(scores[-2:]), [("e", 2), ("b", 5)])
+            self.assertEqual(list(reversed(scores))[0], ("b", 5))
+            self.assertEqual(scores.rank("e"), 2)
+            self.assertIn(("d", 0), scores)
+            self.assertEqual([key for key, _ in by_distance], ["e", "d", "b", "a"])
+            self.assertEqual(d.popitem(last=False)[0], "a")
+            self.assertEqual(len(scores), 3)
+            self.assertRaises(KeyError, scores.rank, "a")
+
+            with self.assertRaises(RuntimeError):
+                for key, _ in scores:
+                    d[key] = 10
+            d.clear()
+            self.assertEqual(list(scores), [])
+            self.assertEqual(len(d._observers), 2)
+            del scores, by_distance
+            self.assertEqual(len(d._observers), 0)
+            self.assertEqual(pickle.loads(pickle.dumps(d)), d)
+
+
+class CompactIndexedOrderedDictTestCase(unittest.TestCase):
+    def test_compact(self):
+        d = indexed.CompactIndexedOrderedDict([("a", 1), ("b", 2), ("c", 3)], d=4)
+        d["b"] = 20
+        d["e"] = 5
+        del d["a"]
+        d.move_to_end("c")
+        d.move_to_end("e", last=False)
+        self.assertEqual(list(d.items()), [("e", 5), ("b", 20), ("d", 4), ("c", 3)])
+        self.assertEqual(d._values, [5, 20, 4, 3])
+        self.assertEqual(d.values()[1], 20)
+        self.assertEqual(d.items()[-1], ("c", 3))
+        self.assertEqual(list(d.values()[::2]), [5, 4])
+        self.assertEqual(list(reversed(d.items())), [("c", 3), ("d", 4), ("b", 20), ("e", 5)])
+        self.assertEqual(d.keys().index("d"), 2)
+        self.assertEqual(d.popitem(last=False), ("e", 5))
+        self.assertEqual(d.pop("d"), 4)
+        d.sort()
+        self.assertEqual(list(d.values()), [20, 3])
+
+        for other in [d.copy(), pickle.loads(pickle.dumps(d))]:
+            self.assertIsInstance(other, indexed.CompactIndexedOrderedDict)
+            self.assertEqual(other, d)
+            self.assertEqual(other._values, [20, 3])
+        self.assertRaises(ValueError, d.set_engine, "tree")
+        d.clear()
+        self.assertEqual(d._values, [])
+
+
+class BoundedIndexedOrderedDictTestCase(unittest.TestCase):
+    def test_eviction(self):
+        evicted = []
+        d = indexed.BoundedIndexedOrderedDict([("a", 1), ("b", 2)], 3)
+        d.on_evict = lambda key, value: evicted.append((key, value))
+        self.assertIs(d.engine, indexed.OffsetList)
+        d.update(c=3, d=4, e=5)
+        self.assertEqual(list(d.items()), [("c", 3), ("d", 4), ("e", 5)])
+        self.assertEqual(evicted, [("a", 1), ("b", 2)])
+        d["c"] = 30
+        self.assertEqual(len(evicted), 2)
+        d.setdefault("f", 6)
+        self.assertEqual(d.keys()[0], "d")
+        self.assertEqual(d.values()[-1], 6)
+        self.assertEqual(d.keys().index("f"), 2)
+        self.assertEqual(evicted[-1], ("c", 30))
+
+        c = d.copy()
+        self.assertEqual(c.maxlen, 3)
+        c["g"] = 7
+        self.assertEqual(list(c), ["e", "f", "g"])
+        self.assertEqual(list(d), ["d", "e", "f"])
+        self.assertEqual(repr(d), "BoundedIndexedOrderedDict([('d', 4), ('e', 5), ('f', 6)], maxlen=3)")
+
+        evicted.clear()
+        merged = d | {"h": 8}
+        self.assertIsInstance(merged, indexed.BoundedIndexedOrderedDict)
+        self.assertEqual(list(merged), ["e", "f", "h"])
+        self.assertEqual(list({"x": 1, "y": 2} | d), ["d", "e", "f"])
+        self.assertEqual(evicted, [])
+        self.assertIs(merged.on_evict, d.on_evict)
+
+        d.on_evict = None
+        unpickled = pickle.loads(pickle.dumps(d))
+        self.assertEqual(unpickled.maxlen, 3)
+        self.assertEqual(unpickled, d)
+
+    def test_map_values(self):
+        d = indexed.BoundedIndexedOrderedDict(maxlen=3, a=1, b=2)
+        doubled = d.map_values(lambda value: 2 * value)
+        self.assertEqual(doubled.maxlen, 3)
+        doubled.update(c=6, d=8)
+        self.assertEqual(list(doubled.items()), [("b", 4), ("c", 6), ("d", 8)])
+
+    def test_unbounded(self):
+        d = indexed.BoundedIndexedOrderedDict(dict.fromkeys(range(10)))
+        self.assertEqual(len(d), 10)
+        self.assertEqual(indexed.BoundedDict({"a": 1}), {"a": 1})
+        self.assertRaises(ValueError, indexed.BoundedIndexedOrderedDict, maxlen=-1)
+        self.assertEqual(len(indexed.BoundedIndexedOrderedDict(maxlen=0, a=1)), 0)
+
+
+class ExpiringIndexedOrderedDictTestCase(unittest.TestCase):
+    def setUp(self):
+        self.now = 0
+        self.d = indexed.ExpiringIndexedOrderedDict(1000, clock=lambda: self.now)
+
+    def test_expiry(self):
+        d = self.d
+        for i in range(1000):
+            d[i] = str(i)
+            self.now += 1
+        self.now = 1250
+        self.assertEqual(d.keys()[0], 251)
+        self.assertEqual(len(d), 749)
+        self.assertEqual(d._order._head, 251)
+        self.assertEqual(list(d.values()[:2]), ["251", "252"])
+
+        self.now = 1300
+        self.assertNotIn(300, d)
+        self.assertRaises(KeyError, operator.getitem, d, 300)
+        self.assertIsNone(d.get(300))
+        self.assertEqual(d[301], "301")
+        self.assertEqual(d.items()[0], (301, "301"))
+
+        d[301] = "renewed"
+        d.move_to_end(302)
+        self.assertRaises(TypeError, d.move_to_end, 303, last=False)
+        self.assertRaises(TypeError, d.sort)
+        self.assertRaises(ValueError, d.set_engine, "list")
+        self.now = 1301
+        self.assertEqual(list(d.keys()[:2]), [303, 304])
+        self.assertEqual(d.keys()[-1], 302)
+
+        self.assertEqual(d.pop(303), "303")
+        self.assertEqual(d.popitem(last=False), (304, "304"))
+        self.assertRaises(KeyError, d.pop, 0)
+        keys, values, items = d.keys(), d.values(), d.items()
+        self.assertIn(305, keys)
+        self.now = 1305
+        self.assertNotIn(305, keys)
+        self.assertNotIn("305", values)
+        self.assertNotIn((305, "305"), items)
+        self.assertTrue(keys.isdisjoint({305}))
+        self.assertEqual(keys & {305, 306}, {306})
+        self.assertEqual(items & {(305, "305")}, set())
+        self.now = 5000
+        self.assertEqual(list(d), [])
+        d["a"] = 1
+        self.assertEqual(d, {"a": 1})
+
+    def test_equality(self):
+        d = self.d
+        d.update(a=1, b=2)
+        values = d.values()
+        self.assertEqual(list(values), [1, 2])
+        other = indexed.ExpiringIndexedOrderedDict(1000, clock=lambda: self.now)
+        other.update(a=1, b=2)
+        self.assertEqual(d, other)
+        self.now = 1000
+        self.assertEqual(list(values), [])
+        self.assertEqual(d, {})
+        self.assertNotEqual(d, {"a": 1, "b": 2})
+        self.assertEqual({}, d)
+        self.assertEqual(d, other)
+        self.assertEqual(d, indexed.IndexedOrderedDict())
+        self.assertEqual(indexed.IndexedOrderedDict(), d)
+
+    def test_sorted_values_view(self):
+        d = self.d
+        d["a"] = 3
+        self.now = 500
+        d.update(b=1, c=2)
+        scores = d.sorted_values_view()
+        self.assertEqual(list(scores), [("b", 1), ("c", 2), ("a", 3)])
+        self.now = 1000
+        self.assertEqual(len(scores), 2)
+        self.assertEqual(scores[0], ("b", 1))
+        self.now = 1500
+        self.assertEqual(list(reversed(scores)), [])
+        d.update(x=1, y=2)
+        iterator = iter(scores)
+        next(iterator)
+        del d["y"]
+        self.assertRaises(RuntimeError, next, iterator)
+
+    def test_copy_and_pickle(self):
+        d = indexed.ExpiringIndexedOrderedDict(10)
+        d.update(a=1, b=2)
+        for clone in d.copy(), pickle.loads(pickle.dumps(d)):
+            self.assertIs(clone.clock, d.clock)
+            self.assertEqual(list(clone.items()), [("a", 1), ("b", 2)])
+            self.assertLessEqual(clone._deadlines["a"] - d._deadlines["a"], 1)
+        self.assertEqual(repr(d), "ExpiringIndexedOrderedDict(10, [('a', 1), ('b', 2)])")
+        self.assertRaises(ValueError, indexed.ExpiringIndexedOrderedDict, -1)
+
+    def test_map_values(self):
+        d = self.d
+        d["a"] = 1
+        self.now = 500
+        d["b"] = 2
+        doubled = d.map_values(lambda value: 2 * value)
+        self.assertIsInstance(doubled, indexed.ExpiringIndexedOrderedDict)
+        self.assertEqual(list(doubled.items()), [("a", 2), ("b", 4)])
+        self.assertEqual(doubled.ttl, 1000)
+        self.now = 1200
+        self.assertEqual(list(doubled), ["b"])
+
+
+class SortedIndexedDictTestCase(unittest.TestCase):
+    def test_sorted(self):
+        d = indexed.SortedIndexedDict({5: "e", 1: "a"}, )
+        d[3] = "c"
+        d.update([(0, "z"), (9, "i")])
+        self.assertEqual(list(d), [0, 1, 3, 5, 9])
+        self.assertEqual(d.keys()[1], 1)
+        self.assertEqual(list(d.keys()[-2:]), [5, 9])
+        self.assertEqual(d.keys().index(5), 3)
+        self.assertEqual(d.keys().bisect_left(3), 2)
+        self.assertEqual(d.keys().bisect_right(3), 3)
+        self.assertEqual(list(d.irange(1, 5)), [1, 3, 5])
+        self.assertEqual(list(d.irange(1, 5, inclusive=(False, False))), [3])
+        self.assertEqual(list(d.irange(maximum=2)), [0, 1])
+        self.assertEqual(list(d.values()[1:3]), ["a", "c"])
+
+        del d[3]
+        self.assertEqual(d.popitem(), (9, "i"))
+        self.assertEqual(d.popitem(last=False), (0, "z"))
+        self.assertEqual(list(d.items()), [(1, "a"), (5, "e")])
+        self.assertRaises(TypeError, d.move_to_end, 1)
+        self.assertRaises(TypeError, d.sort)
+        self.assertRaises(ValueError, d.set_engine, "tree")
+        self.assertRaises(TypeError, d.update, {"x": 1, 2: 2})
+        self.assertEqual(list(d), [1, 5])
+
+        self.assertEqual(list(d | {2: "b"}), [1, 2, 5])
+        self.assertEqual(d.copy(), d)
+        unpickled = pickle.loads(pickle.dumps(d))
+        self.assertIsInstance(unpickled, indexed.SortedIndexedDict)
+        self.assertEqual(list(unpickled.items()), [(1, "a"), (5, "e")])
+
+
+class CacheTestCase(unittest.TestCase):
+    def test_lru(self):
+        c = indexed.LRUCache(3)
+        for key in "abc":
+            c[key] = key.upper()
+        self.assertEqual(list(c), ["c", "b", "a"])
+        self.assertEqual(c.values()[2], "A")
+        self.assertEqual(c.items()[-1], ("a", "A"))
+        self.assertEqual(list(c.values()[1:]), ["B", "A"])
+        self.assertEqual(list(c), ["c", "b", "a"])
+        self.assertEqual(c["a"], "A")
+        self.assertEqual(c.peek("b"), "B")
+        self.assertEqual(c.keys()[0], "a")
+        self.assertEqual(c.keys().index("b"), 2)
+        c["d"] = "D"
+        self.assertEqual(list(c), ["d", "a", "c"])
+        self.assertEqual(c.get("c"), "C")
+        self.assertEqual(c.get("b", 0), 0)
+        self.assertEqual(c.popitem(), ("a", "A"))
+        self.assertEqual(c.pop("c"), "C")
+        self.assertEqual(list(c.items()), [("d", "D")])
+        c.move_to_end("d")
+        c.clear()
+        self.assertEqual((len(c), c.weight), (0, 0))
+
+    def test_copy_to_dict(self):
+        c = indexed.LRUCache(10)
+        for key in "abcdef":
+            c[key] = key
+        self.assertEqual(list(dict(c.items())), list("fedcba"))
+        self.assertEqual(list(indexed.IndexedOrderedDict(c)), list("fedcba"))
+        d = indexed.IndexedOrderedDict()
+        d.update(c)
+        self.assertEqual(list(c.copy()), list("fedcba"))
+        self.assertEqual(list(c), list("fedcba"))
+        self.assertEqual(c["c"], "c")
+        self.assertEqual(c.keys()[0], "c")
+        self.assertEqual(list(dict(c)), list("cfedba"))
+        self.assertEqual(list(c), list("abdefc"))
+
+    def test_promotion_is_a_mutation(self):
+        a = indexed.LRUCache(3)
+        a.update(a=1, b=2, c=3)
+        b = a.copy()
+        self.assertEqual(a, b)
+        self.assertEqual(a.values().tolist(), [3, 2, 1])
+        a.get("a")
+        self.assertNotEqual(a, b)
+        self.assertEqual(a.values().tolist(), [1, 3, 2])
+        self.assertEqual(a.items().tolist(), [("a", 1), ("c", 3), ("b", 2)])
+        with self.assertRaises(RuntimeError):
+            for key in a:
+                a.get(key)
+
+    def test_weigher(self):
+        c = indexed.LRUCache(10, weigher=lambda key, value: len(value))
+        c["a"] = "xxxx"
+        c["b"] = "xxxx"
+        c.get("a")
+        c["c"] = "xxx"
+        self.assertEqual(list(c), ["c", "a"])
+        self.assertEqual(c.weight, 7)
+        c["a"] = "x"
+        self.assertEqual(c.weight, 4)
+        del c["c"]
+        self.assertEqual(c.weight, 1)
+        c["d"] = "x" * 11
+        self.assertEqual((len(c), c.weight), (0, 0))
+        self.assertRaises(ValueError, indexed.LRUCache, -1)
+
+    def test_lfu(self):
+        c = indexed.LFUCache(3)
+        for key in "abc":
+            c[key] = key.upper()
+        self.assertEqual(list(c), ["c", "b", "a"])
+        c.get("a")
+        c.get("a")
+        c.get("b")
+        self.assertEqual(list(c), ["a", "b", "c"])
+        self.assertEqual(c.use_count("a"), 3)
+        c["d"] = "D"
+        self.assertEqual(list(c), ["a", "b", "d"])
+        c.get("d")
+        self.assertEqual(list(c), ["a", "d", "b"])
+        self.assertEqual(c.keys().index("b"), 2)
+        self.assertRaises(TypeError, c.move_to_end, "a")
+        self.assertRaises(TypeError, c.sort)
+        del c["d"]
+        self.assertEqual(list(c), ["a", "b"])
+
+    def test_copy_and_pickle(self):
+        for cls in indexed.LRUCache, indexed.LFUCache:
+            c = cls(4)
+            for key in "abcde":
+                c[key] = ord(key)
+            c.get("c")
+            c.get("c")
+            c.get("d")
+            clones = [c.copy(), pickle.loads(pickle.dumps(c))]
+            c["f"] = 0
+            c.get("e")
+            for clone in clones:
+                self.assertEqual(clone.capacity, 4)
+                clone["f"] = 0
+                clone.get("e")
+                self.assertEqual(list(clone.items()), list(c.items()))
+            self.assertEqual(repr(c), "%s(4, %r)" % (cls.__name__, list(c.items())))
+
+    def test_map_values(self):
+        for cls in indexed.LRUCache, indexed.LFUCache:
+            c = cls(1000)
+            for i in range(200):
+                c[i] = i
+            c.get(7)
+            c.get(7)
+            c.get(3)
+            doubled = c.map_values(lambda value: 2 * value)
+            self.assertIsInstance(doubled, cls)
+            self.assertEqual(doubled.capacity, 1000)
+            self.assertEqual(list(doubled), list(c))
+            self.assertEqual(doubled.values()[0], 2 * c.keys()[0])
+            if cls is indexed.LFUCache:
+                self.assertEqual(doubled.use_count(7), 3)
+
+        c = indexed.LRUCache(4, weigher=lambda key, value: len(value))
+        c.update(a="x", b="x")
+        self.assertEqual(list(c.map_values(lambda value: value * 3)), ["b"])
+
 
 class IndexedViewTestCase(unittest.TestCase):
     def setUp(self):
@@ -204,6 +754,392 @@ class IndexedViewTestCase(unittest.TestCase):
         self.assertEqual(items[4], ("key-four", "four"))
         self.assertEqual(items[5], ("key-five", "five"))
 
+    def test_iteration(self):
+        self.assertEqual(list(self.d.values())[:2], ["zero", "one"])
+        self.assertEqual(list(reversed(self.d.values()))[:2], ["five", "four"])
+        self.assertEqual(list(reversed(self.d.items()))[0], ("key-five", "five"))
+        self.assertEqual(list(reversed(self.d.keys()))[-1], "key-zero")
+        self.assertIn("three", self.d.values())
+        self.assertNotIn("six", self.d.values())
+        self.assertIn(("key-two", "two"), self.d.items())
+        self.assertNotIn(("key-two", "three"), self.d.items())
+        self.assertNotIn("key-two", self.d.items())
+        self.assertIn("key-two", self.d.keys())
+
+    def test_set_operations(self):
+        keys = self.d.keys()
+        other = ["key-five", "key-one", "key-six"]
+        self.assertEqual(keys & other, {"key-one", "key-five"})
+        self.assertEqual(other & keys, {"key-one", "key-five"})
+        self.assertEqual(keys - other, {"key-zero", "key-two", "key-three", "key-four"})
+        self.assertEqual(other - keys, {"key-six"})
+        self.assertEqual(len(keys | other), 7)
+        self.assertEqual(keys ^ other, {"key-zero", "key-two", "key-three", "key-four", "key-six"})
+        self.assertFalse(keys.isdisjoint(other))
+        self.assertTrue(keys.isdisjoint(["key-six"]))
+        self.assertEqual(self.d.items() & {("key-one", "one"), ("key-two", "2")}, {("key-one", "one")})
+        self.assertIsInstance(keys & other, set)
+
+        self.assertEqual(keys.ordered_intersection(other), ["key-one", "key-five"])
+        self.assertEqual(keys.ordered_difference(iter(other)), ["key-zero", "key-two", "key-three", "key-four"])
+        self.assertEqual(keys.ordered_union(other)[-2:], ["key-five", "key-six"])
+        self.assertEqual(keys.ordered_symmetric_difference(other)[-2:], ["key-four", "key-six"])
+
+    def test_slices(self):
+        keys = self.d.keys()
+        values = self.d.values()
+        items = self.d.items()
+        self.assertEqual(list(keys[1:3]), ["key-one", "key-two"])
+        self.assertEqual(list(values[::-2]), ["five", "three", "one"])
+        self.assertEqual(list(items[-2:]), [("key-four", "four"), ("key-five", "five")])
+        self.assertEqual(list(reversed(values[:3])), ["two", "one", "zero"])
+
+        window = values[1:5]
+        self.assertIsInstance(window, indexed.IndexedSliceView)
+        self.assertEqual((window.start, window.stop, window.step), (1, 5, 1))
+        self.assertEqual(len(window), 4)
+        self.assertEqual(window[-1], "four")
+        self.assertEqual(list(window[1::2]), ["two", "four"])
+        self.assertIn("three", window)
+        self.assertEqual(keys[0:2], ["key-zero", "key-one"])
+        self.assertEqual(window, ("one", "two", "three", "four"))
+        self.assertEqual(window, values[1:5])
+        self.assertNotEqual(window, ["one"])
+        self.assertNotEqual(window, "one")
+
+        del self.d["key-two"]
+        self.assertEqual(list(window), ["one", "three", "four", "five"])
+        self.assertEqual(len(values[10:20]), 0)
+
+    def test_chunks(self):
+        chunks = list(self.d.items().chunks(4))
+        self.assertEqual([(c.start, c.stop) for c in chunks], [(0, 4), (4, 6)])
+        self.assertEqual(list(chunks[1]), [("key-four", "four"), ("key-five", "five")])
+        self.assertEqual(sum(map(len, self.d.values().chunks(1))), 6)
+        self.assertRaises(ValueError, list, self.d.keys().chunks(0))
+
+    def test_partition(self):
+        parts = self.d.partition(4)
+        self.assertEqual([(p.start, p.stop) for p in parts], [(0, 2), (2, 4), (4, 5), (5, 6)])
+        sub = indexed.IndexedOrderedDict(parts[1])
+        self.assertEqual(list(sub.items()), [("key-two", "two"), ("key-three", "three")])
+        self.assertEqual(len(self.d.partition(8)), 8)
+        self.assertEqual(len(self.d.partition(8)[-1]), 0)
+        self.assertRaises(ValueError, self.d.partition, 0)
+
+    def test_pickle_window(self):
+        d = indexed.IndexedOrderedDict((i, str(i)) for i in range(1000))
+        window = d.partition(8)[2]
+        self.assertLess(len(pickle.dumps(window)), len(pickle.dumps(d)) / 4)
+        clone = pickle.loads(pickle.dumps(window))
+        self.assertEqual((clone.start, clone.stop), (window.start, window.stop))
+        self.assertEqual(clone, window)
+        self.assertEqual(clone[1:3], window[1:3])
+        self.assertEqual(list(reversed(clone)), list(reversed(window)))
+        self.assertEqual(indexed.IndexedOrderedDict(clone), indexed.IndexedOrderedDict(window))
+
+    def test_take(self):
+        self.assertEqual(self.d.keys().take([5, 0, -1]), ["key-five", "key-zero", "key-five"])
+        self.assertEqual(self.d.values().take(range(1, 3)), ["one", "two"])
+        self.assertEqual(self.d.items().take([True, False, False, False, False, True]),
+                         [("key-zero", "zero"), ("key-five", "five")])
+        self.assertRaises(IndexError, self.d.values().take, [True, False])
+        self.assertRaises(IndexError, self.d.values().take, [6])
+
+    def test_indices_of(self):
+        keys = self.d.keys()
+        self.assertEqual(keys.indices_of(["key-three", "key-zero"]), [3, 0])
+        self.assertEqual(keys.indices_of(["key-one"]), [1])
+        self.assertRaises(ValueError, keys.indices_of, ["key-one", "missing"])
+        self.d.set_engine(indexed.PositionList)
+        self.assertEqual(keys.indices_of(iter(["key-four", "key-two"])), [4, 2])
+        self.assertRaises(ValueError, keys.indices_of, ["missing"])
+
+
+class EngineTestMixin:
+    engine = list
+
+    def test_against_list(self):
+        rng = random.Random(42)
+        expected = []
+        engine = self.engine()
+        for i in range(2000):
+            op = rng.randrange(5)
+            if op == 0 or not expected:
+                expected.append(i)
+                engine.append(i)
+            elif op == 1:
+                pos = rng.randrange(-len(expected), len(expected) + 1)
+                expected.insert(pos, i)
+                engine.insert(pos, i)
+            elif op == 2:
+                key = rng.choice(expected)
+                expected.remove(key)
+                engine.remove(key)
+            elif op == 3:
+                pos = rng.randrange(-len(expected), len(expected))
+                self.assertEqual(engine.pop(pos), expected.pop(pos))
+            else:
+                pos = rng.randrange(len(expected))
+                self.assertEqual(engine[pos], expected[pos])
+                self.assertEqual(engine.index(expected[pos]), pos)
+            self.assertEqual(len(engine), len(expected))
+        self.assertEqual(list(engine), expected)
+        self.assertEqual(list(reversed(engine)), expected[::-1])
+        self.assertEqual(engine[3:20:3], expected[3:20:3])
+
+    def test_dict(self):
+        d = indexed.IndexedOrderedDict((str(i), i) for i in range(50))
+        d.set_engine(self.engine)
+        del d["10"]
+        d.move_to_end("0")
+        d.move_to_end("20", last=False)
+        self.assertEqual(d.keys()[0], "20")
+        self.assertEqual(d.keys()[-1], "0")
+        self.assertEqual(d.keys().index("11"), 10)
+        self.assertEqual(d.values()[10], 11)
+        self.assertEqual(d.popitem(last=False), ("20", 20))
+        self.assertIsInstance(d.copy()._map, self.engine)
+        self.assertEqual(d.copy(), d)
+
+
+class EngineTestCase(unittest.TestCase):
+    def test_names(self):
+        for name, engine in indexed.ENGINES.items():
+            d = indexed.IndexedOrderedDict.with_engine(name, [("a", 1), ("b", 2)], c=3)
+            self.assertIs(d.engine, engine)
+            self.assertTrue(issubclass(engine, indexed.OrderEngine))
+            self.assertEqual(list(d.items()), [("a", 1), ("b", 2), ("c", 3)])
+            self.assertEqual(d.keys().index("c"), 2)
+        self.assertIs(indexed.IndexedOrderedDict().engine, list)
+        self.assertRaises(ValueError, indexed.IndexedOrderedDict.with_engine, "unknown")
+
+    def test_switch(self):
+        d = indexed.IndexedOrderedDict.fromkeys("abcdef")
+        for name in ["tree", "tombstone", "offset", "position", "list"]:
+            d.set_engine(name)
+            del d[d.keys()[1]]
+            d["x" + name] = None
+        self.assertEqual(list(d), ["a", "xtree", "xtombstone", "xoffset", "xposition", "xlist"])
+
+
+class LazyListTestCase(EngineTestMixin, unittest.TestCase):
+    engine = indexed.LazyList
+
+    def test_lazy(self):
+        d = indexed.IndexedOrderedDict.with_engine("lazy", dict.fromkeys("abcde"))
+        self.assertIsNone(d._map._keys)
+        d["f"] = None
+        del d["b"]
+        self.assertEqual(d.popitem(), ("f", None))
+        self.assertEqual(d.popitem(last=False), ("a", None))
+        self.assertIsNone(d._map._keys)
+        self.assertEqual(list(reversed(d)), ["e", "d", "c"])
+
+        self.assertEqual(d.keys()[1], "d")
+        self.assertEqual(d._map._keys, ["c", "d", "e"])
+        d["g"] = None
+        self.assertEqual(d.keys().index("g"), 3)
+        del d["d"]
+        self.assertIsNone(d._map._keys)
+        self.assertEqual(list(d.values()[:]), [None] * 3)
+
+        d.move_to_end("c")
+        d["h"] = None
+        del d["e"]
+        self.assertEqual(list(d), ["g", "c", "h"])
+        self.assertEqual(d.keys()[0], "g")
+        self.assertEqual(d.popitem(last=False), ("g", None))
+        self.assertEqual(d.copy(), d)
+        self.assertEqual(pickle.loads(pickle.dumps(d)), d)
+        d.clear()
+        self.assertIsNone(d._map._keys)
+
+        d["a"] = 1
+        del d["a"]
+        d["b"] = 2
+        self.assertEqual(d.pop("b"), 2)
+        self.assertEqual((len(d), list(d)), (0, []))
+        self.assertIsNone(d._map._keys)
+
+
+class AdaptiveEngineTestCase(EngineTestMixin, unittest.TestCase):
+    engine = indexed.AdaptiveEngine
+
+    def test_migration(self):
+        d = indexed.IndexedOrderedDict.with_engine("auto", dict.fromkeys(range(20000)))
+        self.assertIs(type(d._map._engine), list)
+        for i in range(0, 20000, 2):
+            del d[i]
+        self.assertIs(type(d._map._engine), indexed.TombstoneList)
+        for i in range(1, 8000, 2):
+            d.popitem(last=False)
+        self.assertIs(type(d._map._engine), indexed.OffsetList)
+        self.assertEqual(d.keys()[0], 8001)
+        self.assertEqual(d.keys().index(8003), 1)
+        self.assertEqual(len(d), len(d._map))
+
+
+class BlockedListTestCase(EngineTestMixin, unittest.TestCase):
+    engine = indexed.BlockedList
+
+    def setUp(self):
+        self.load = indexed.BlockedList._load
+        indexed.BlockedList._load = 4
+
+    def tearDown(self):
+        indexed.BlockedList._load = self.load
+
+
+class TombstoneListTestCase(EngineTestMixin, unittest.TestCase):
+    engine = indexed.TombstoneList
+
+    def test_compaction(self):
+        engine = indexed.TombstoneList(range(100))
+        for key in range(0, 100, 2):
+            engine.remove(key)
+        self.assertEqual(engine._slots.count(indexed._TOMBSTONE), 50)
+        self.assertEqual(engine.index(91), 45)
+        engine.remove(51)
+        self.assertEqual(len(engine._slots), 49)
+        self.assertEqual(engine.index(91), 44)
+        for key in range(91, 100, 2):
+            engine.remove(key)
+        self.assertEqual(len(engine._slots), 44)
+        self.assertEqual(engine[-1], 89)
+
+    def test_move_to_end(self):
+        d = indexed.IndexedOrderedDict.fromkeys(range(20))
+        d.set_engine(indexed.TombstoneList)
+        d.move_to_end(5, last=False)
+        head = d._map._head
+        self.assertGreater(head, 0)
+        for key in [7, 3, 12]:
+            d.move_to_end(key, last=False)
+        self.assertEqual(d._map._head, head - 3)
+        d.move_to_end(12)
+        d.move_to_end(0)
+        self.assertEqual(list(d), [3, 7, 5, 1, 2, 4, 6, 8, 9, 10, 11, 13, 14, 15, 16, 17, 18, 19, 12, 0])
+        self.assertEqual(d.keys()[2], 5)
+        self.assertEqual(d.keys().index(1), 3)
+        self.assertEqual(d.popitem(last=False), (3, None))
+        self.assertEqual(d.keys()[0], 7)
+
+
+class PositionListTestCase(EngineTestMixin, unittest.TestCase):
+    engine = indexed.PositionList
+
+    def test_positions(self):
+        engine = indexed.PositionList("abcde")
+        engine.remove("b")
+        engine.insert(0, "f")
+        engine.append("g")
+        self.assertEqual(engine._slot_of, {key: i + engine._base for i, key in enumerate(engine)})
+        self.assertEqual(engine.index("g"), 5)
+        self.assertEqual(engine.pop(), "g")
+        self.assertRaises(ValueError, engine.index, "g")
+
+        engine = indexed.PositionList(range(100))
+        slot_of = engine._slot_of.copy()
+        for i in range(10):
+            self.assertEqual(engine.pop(0), i)
+        engine.remove(20)
+        self.assertEqual(engine._slot_of[99], slot_of[99])
+        self.assertEqual(list(map(engine.index, engine)), list(range(89)))
+        engine.insert(80, "x")
+        engine.insert(1, "y")
+        self.assertEqual(list(map(engine.index, engine)), list(range(91)))
+
+
+class OffsetListTestCase(EngineTestMixin, unittest.TestCase):
+    engine = indexed.OffsetList
+
+    def test_front(self):
+        d = indexed.IndexedOrderedDict.fromkeys(range(100))
+        d.set_engine(indexed.OffsetList)
+        for i in range(60):
+            self.assertEqual(d.popitem(last=False), (i, None))
+            self.assertEqual(d.keys()[0], i + 1)
+            self.assertEqual(d.keys()[-1], 99)
+        self.assertLess(d._map._head, 60)
+        for i in range(99, 89, -1):
+            d.move_to_end(i, last=False)
+        self.assertEqual(list(d)[:12], [90, 91, 92, 93, 94, 95, 96, 97, 98, 99, 60, 61])
+        self.assertEqual(d.keys().index(60), 10)
+        self.assertEqual(list(reversed(d))[:2], [89, 88])
+
+    def test_delete_slice(self):
+        engine = indexed.OffsetList(range(100))
+        expected = list(range(100))
+        del engine[:30]
+        del expected[:30]
+        self.assertEqual(engine._head, 30)
+        self.assertEqual(engine[:3], [30, 31, 32])
+        self.assertEqual(engine[-2:], [98, 99])
+        self.assertEqual(engine[::-40], expected[::-40])
+        del engine[:40]
+        del expected[:40]
+        self.assertEqual(engine._head, 0)
+        del engine[5:20:3]
+        del expected[5:20:3]
+        del engine[-1]
+        del expected[-1]
+        self.assertEqual(list(engine), expected)
+
+
+class SortedListTestCase(unittest.TestCase):
+    def setUp(self):
+        self._load = indexed.SortedList._load
+        indexed.SortedList._load = 4
+
+    def tearDown(self):
+        indexed.SortedList._load = self._load
+
+    def test_against_list(self):
+        rng = random.Random(1)
+        engine = indexed.SortedList()
+        expected = []
+        for _ in range(3000):
+            key = rng.randrange(200)
+            op = rng.random()
+            if op < 0.4 and key not in expected:
+                engine.add(key)
+                expected.append(key)
+                expected.sort()
+            elif op < 0.6 and expected:
+                key = rng.choice(expected)
+                engine.remove(key)
+                expected.remove(key)
+            elif op < 0.65 and expected:
+                index = rng.randrange(-len(expected), len(expected))
+                self.assertEqual(engine.pop(index), expected.pop(index))
+            elif op < 0.7:
+                keys = set(rng.randrange(200) for _ in range(rng.randrange(20))) - set(expected)
+                engine.extend(keys)
+                expected = sorted(expected + list(keys))
+            self.assertEqual(len(engine), len(expected))
+            self.assertEqual(engine.bisect_left(key), sum(k < key for k in expected))
+            self.assertEqual(engine.bisect_right(key), sum(k <= key for k in expected))
+            self.assertEqual(key in engine, key in expected)
+            lo, hi = sorted((rng.randrange(200), rng.randrange(200)))
+            self.assertEqual(list(engine.irange(lo, hi)), [k for k in expected if lo <= k <= hi])
+            self.assertEqual(engine[lo // 4:hi // 4], expected[lo // 4:hi // 4])
+        self.assertEqual(list(engine), expected)
+        self.assertEqual(list(reversed(engine)), expected[::-1])
+        self.assertEqual(list(map(engine.index, expected)), list(range(len(expected))))
+        self.assertEqual(list(map(engine.__getitem__, range(len(expected)))), expected)
+
+    def test_append(self):
+        engine = indexed.SortedList([1, 3])
+        engine.append(4)
+        engine.insert(1, 2)
+        self.assertEqual(list(engine), [1, 2, 3, 4])
+        self.assertRaises(ValueError, engine.append, 0)
+        self.assertRaises(ValueError, engine.insert, 0, 5)
+        self.assertRaises(ValueError, engine.remove, 5)
+        self.assertRaises(TypeError, engine.sort, reverse=True)
+        self.assertEqual(engine.copy()[::-1], [4, 3, 2, 1])
+
 
 if __name__ == "__main__":
     unittest.main()